@@ -0,0 +1,129 @@
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "proj"))
+from create_files import generate_tree
+
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run_one(files, workdir, jobs, options):
+    """Generate a tree of `files` files in workdir, time every phase and return the results."""
+    import modules
+    from scheduler import run_actions, action_paths
+
+    scan_dirs = generate_tree(os.path.join(workdir, "tree"), files, **options)
+    # modules reads these from config at import time
+    modules.SCAN_DIRS = scan_dirs
+    modules.MAIN_FOLDER = os.path.join(workdir, "main")
+    modules.ACTIONS_FILE = os.path.join(workdir, "actions.json")
+
+    phases = []
+
+    def phase(name, func, count=files):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        phases.append({
+            "phase": name,
+            "count": count,
+            "seconds": round(elapsed, 4),
+            "files_per_second": round(count / elapsed) if elapsed > 0 else None,
+            "peak_rss_kb": peak_rss_kb(),
+        })
+        return result
+
+    stats = {}
+    files_list, duplicates = phase(
+        "scan_directories", lambda: modules.scan_directories(stats, None, jobs)
+    )
+    grouped_actions = phase("analyze_files", lambda: modules.analyze_files(files_list, duplicates))
+    del files_list, duplicates
+    grouped_actions = modules.prepare_replay_actions(grouped_actions)
+    actions = sum(len(a) for a in grouped_actions.values())
+    phase("save_actions_to_json", lambda: modules.save_actions_to_json(grouped_actions))
+    del grouped_actions
+    loaded = phase("load_actions_from_json", modules.load_actions_from_json)
+
+    deleted_paths = set()
+
+    def resolve(action):
+        return None if action["path"] in deleted_paths else action
+
+    def done(action, result):
+        if result.startswith("Deleted:"):
+            deleted_paths.add(action["path"])
+
+    items = [action for group in loaded.values() for action in group]
+    phase("replay", lambda: run_actions(items, action_paths, resolve, done, jobs), count=actions)
+
+    return {
+        "files": files,
+        "jobs": jobs,
+        "actions": actions,
+        "bytes_hashed": stats.get("bytes_hashed", 0),
+        "scan": stats,
+        "phases": phases,
+    }
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Benchmark scan, analyze, JSON and replay on synthetic trees"
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000],
+                        help="file counts to benchmark")
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument("--workdir", help="where trees are generated (default: a temporary directory)")
+    parser.add_argument("--output", default="bench_results.json", help="JSON results file")
+    parser.add_argument("--max-size", type=int, default=16384)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.1)
+    parser.add_argument("--bad-char-ratio", type=float, default=0.05)
+    parser.add_argument("--temp-ratio", type=float, default=0.05)
+    parser.add_argument("--run-one", type=int, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    options = {
+        "max_size": args.max_size,
+        "duplicate_ratio": args.duplicate_ratio,
+        "bad_char_ratio": args.bad_char_ratio,
+        "temp_ratio": args.temp_ratio,
+    }
+
+    if args.run_one is not None:
+        # child process, so peak RSS belongs to this size only
+        print(json.dumps(run_one(args.run_one, args.workdir, args.jobs, options)))
+        return
+
+    results = []
+    for files in args.sizes:
+        with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+            command = [
+                sys.executable, os.path.abspath(__file__), "--run-one", str(files),
+                "--workdir", workdir, "--jobs", str(args.jobs),
+                "--max-size", str(args.max_size),
+                "--duplicate-ratio", str(args.duplicate_ratio),
+                "--bad-char-ratio", str(args.bad_char_ratio),
+                "--temp-ratio", str(args.temp_ratio),
+            ]
+            output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        results.append(result)
+        for p in result["phases"]:
+            print(f"{files:>9} files  {p['phase']:<24} {p['seconds']:>9.3f}s "
+                  f"{p['files_per_second'] or 0:>10}/s  {p['peak_rss_kb']:>9} KB")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}, f, indent=4)
+    print(f"Saved results to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,20 @@
 import os
+import sys
+import math
+import random
 import shutil
 import time
+import argparse
 
 def create_file(path, content="", mtime=None, permissions=0o644):
     """Create a file with specified content, modification time, and permissions."""
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        f.write(content)
+    if isinstance(content, bytes):
+        with open(path, "wb") as f:
+            f.write(content)
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
     if mtime is not None:
         os.utime(path, (mtime, mtime))
     os.chmod(path, permissions)
@@ -18,8 +26,86 @@ def clear_directories(dirs):
             shutil.rmtree(dir)
         os.makedirs(dir)
 
+def generate_tree(root, files=10000, dirs=3, depth=3, fanout=4, min_size=1, max_size=16384,
+                  duplicate_ratio=0.1, bad_char_ratio=0.05, temp_ratio=0.05, empty_ratio=0.01,
+                  seed=0):
+    """Create a synthetic tree for benchmarks and return the scan directories.
+
+    Files are spread over `dirs` top-level directories, each with `fanout`
+    subdirectories per level down to `depth`. Sizes follow a log-uniform
+    distribution between min_size and max_size. The ratios are the share of
+    files that copy an earlier file's content, get a character from
+    config.BAD_CHARS in their name, get a temporary extension, or are empty.
+    """
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "proj"))
+    from config import BAD_CHARS, TEMP_EXTENSIONS
+
+    rng = random.Random(seed)
+    scan_dirs = [os.path.join(root, f"d{i}") for i in range(dirs)]
+    clear_directories([root])
+
+    folders = []
+    for scan_dir in scan_dirs:
+        level = [scan_dir]
+        for _ in range(depth):
+            folders.extend(level)
+            level = [os.path.join(d, f"s{i}") for d in level for i in range(fanout)]
+        folders.extend(level)
+
+    contents = []  # sample of earlier contents to copy as duplicates
+    log_min, log_max = math.log(max(min_size, 1)), math.log(max(max_size, 1))
+    for i in range(files):
+        name = f"file{i}"
+        if rng.random() < bad_char_ratio:
+            name += rng.choice(BAD_CHARS)
+        name += ".dat"
+        if rng.random() < temp_ratio:
+            name += rng.choice(TEMP_EXTENSIONS)
+
+        roll = rng.random()
+        if roll < empty_ratio:
+            content = b""
+        elif roll < empty_ratio + duplicate_ratio and contents:
+            content = rng.choice(contents)
+        else:
+            content = rng.randbytes(int(math.exp(rng.uniform(log_min, log_max))))
+            if len(contents) < 1000:
+                contents.append(content)
+            else:
+                contents[rng.randrange(len(contents))] = content
+        create_file(os.path.join(rng.choice(folders), name), content)
+    return scan_dirs
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Create the x/y1/y2 fixtures, or a synthetic tree with --files"
+    )
+    parser.add_argument("--files", type=int, help="number of files in the synthetic tree")
+    parser.add_argument("--root", default="bench_tree", help="where the synthetic tree is created")
+    parser.add_argument("--dirs", type=int, default=3, help="top-level scan directories")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fanout", type=int, default=4)
+    parser.add_argument("--min-size", type=int, default=1)
+    parser.add_argument("--max-size", type=int, default=16384)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.1)
+    parser.add_argument("--bad-char-ratio", type=float, default=0.05)
+    parser.add_argument("--temp-ratio", type=float, default=0.05)
+    parser.add_argument("--empty-ratio", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
 def main():
     """Create test files for file organization project."""
+    args = parse_arguments()
+    if args.files is not None:
+        scan_dirs = generate_tree(
+            args.root, args.files, args.dirs, args.depth, args.fanout, args.min_size,
+            args.max_size, args.duplicate_ratio, args.bad_char_ratio, args.temp_ratio,
+            args.empty_ratio, args.seed
+        )
+        print(f"Created {args.files} files in: {', '.join(scan_dirs)}")
+        return
+
     # Define directories matching config.py
     dirs = ["x", "y1", "y2"]
     
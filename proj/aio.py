@@ -0,0 +1,75 @@
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+def read_mount_points(path="/proc/self/mounts"):
+    # longest first, so the first prefix match is the mount a path lives on
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            points = {line.split()[1].replace("\\040", " ") for line in f if line.strip()}
+    except OSError:
+        points = {"/"}
+    return sorted(points, key=len, reverse=True)
+
+def _path_of(arg):
+    # the first argument of a submitted call is a path, or an action with one
+    return arg.get("path", "") if isinstance(arg, dict) else os.fsdecode(arg)
+
+
+class IOEngine:
+    """Blocking filesystem calls driven from an asyncio loop on its own thread.
+
+    submit(func, path, ...) has the concurrent.futures signature, so
+    parallel_walk, bounded_map and run_actions take the engine in place of
+    a pool. Calls run on `threads` threads, but at most per_mount of them on
+    one mount point at a time; the others wait as coroutines in the loop
+    without holding a thread, so a slow NFS mount cannot starve the rest.
+    """
+
+    def __init__(self, threads, per_mount):
+        self.pool = ThreadPoolExecutor(threads)
+        self.capacity = threads  # calls that can run at once, callers size their windows on it
+        self.per_mount = per_mount
+        self.mounts = read_mount_points()
+        self.mount_of_dir = {}
+        self.limits = {}
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def mount(self, path):
+        directory = os.path.dirname(os.path.abspath(path))
+        mount = self.mount_of_dir.get(directory)
+        if mount is None:
+            mount = next(
+                (m for m in self.mounts if directory == m or directory.startswith(m.rstrip("/") + "/")),
+                "/"
+            )
+            self.mount_of_dir[directory] = mount
+        return mount
+
+    async def call(self, mount, func, *args):
+        # runs in the loop thread, so the semaphores need no lock
+        limit = self.limits.get(mount)
+        if limit is None:
+            limit = self.limits[mount] = asyncio.Semaphore(self.per_mount)
+        async with limit:
+            return await self.loop.run_in_executor(self.pool, func, *args)
+
+    def submit(self, func, *args):
+        mount = self.mount(_path_of(args[0]))
+        return asyncio.run_coroutine_threadsafe(self.call(mount, func, *args), self.loop)
+
+    def shutdown(self, wait=True):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.pool.shutdown(wait)
+        self.loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
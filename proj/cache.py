@@ -0,0 +1,73 @@
+import sqlite3
+import time
+
+
+class HashCache:
+    """On-disk cache of file hashes keyed on (device, inode, size, mtime_ns).
+
+    Rows are stored per kind and algorithm ("full:sha256", "partial:4096:sha256"),
+    so changing HASH_ALGORITHM or PARTIAL_HASH_SIZE never returns a digest
+    that cannot match a freshly computed one.
+    """
+
+    def __init__(self, path, max_age, algorithm):
+        self.path = path
+        self.max_age = max_age
+        self.algorithm = algorithm
+        self.hits = 0
+        self.misses = 0
+        self.now = int(time.time())
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            " dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER,"
+            " kind TEXT, hash TEXT, last_seen INTEGER,"
+            " PRIMARY KEY (dev, ino, kind))"
+        )
+
+    def get(self, key, kind):
+        # key is (dev, ino, size, mtime_ns)
+        dev, ino, size, mtime_ns = key
+        kind = f"{kind}:{self.algorithm}"
+        row = self.db.execute(
+            "SELECT size, mtime_ns, hash FROM hashes WHERE dev = ? AND ino = ? AND kind = ?",
+            (dev, ino, kind)
+        ).fetchone()
+        if row is None or row[0] != size or row[1] != mtime_ns:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.db.execute(
+            "UPDATE hashes SET last_seen = ? WHERE dev = ? AND ino = ? AND kind = ?",
+            (self.now, dev, ino, kind)
+        )
+        return row[2]
+
+    def put(self, key, kind, value):
+        self.db.execute(
+            "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (*key, f"{kind}:{self.algorithm}", value, self.now)
+        )
+
+    def evict(self):
+        # entries not used for max_age seconds belong to files that are gone or never collide
+        cursor = self.db.execute(
+            "DELETE FROM hashes WHERE last_seen < ?", (self.now - self.max_age,)
+        )
+        return cursor.rowcount
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.evict()
+        self.db.commit()
+        self.db.close()
+
+
+def open_hash_cache(path, max_age, algorithm):
+    try:
+        return HashCache(path, max_age, algorithm)
+    except sqlite3.Error as e:
+        print(f"Hash cache disabled, cannot open {path}: {e}")
+        return None
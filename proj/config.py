@@ -1,11 +1,66 @@
 
 SCAN_DIRS = ["../x","../y1","../y2"]
+# scan scope, checked while walking: excluded directories are never entered
+SCAN_INCLUDE = [] # file name globs, e.g. ["*.jpg", "*.png"]; empty scans every file
+SCAN_EXCLUDE = [] # file and directory globs, e.g. [".git", "node_modules", "*/cache"]
+SCAN_MAX_DEPTH = None # 0 = only files directly in SCAN_DIRS
+SCAN_MIN_SIZE = 0 # bytes
+SCAN_MAX_SIZE = None
+SCAN_OLDER_THAN_DAYS = None # only files last modified before / after that many days ago
+SCAN_NEWER_THAN_DAYS = None
+SCAN_ONE_FILESYSTEM = False # do not cross into other mounts (st_dev of the scan root)
 
 TEMP_EXTENSIONS = [".tmp", ".bak", "~"]
 BAD_CHARS = [":", "\"", ";", "*", "?", "$", "#", "'", "|", "\\"]
 REPLACE_CHAR = "_"
 DEFAULT_PERMISSIONS = 0o644# "rw-r--r--"
 ACTIONS_FILE = "actions.json"
+ACTIONS_JSONL_FILE = "actions.jsonl" # one action per line, written and replayed as a stream
+ACTIONS_FORMAT = "json" # "json" (grouped) or "jsonl"
+REPLAY_JOURNAL_FILE = "replay.journal" # finished actions of an interrupted replay
+JOURNAL_SYNC_EVERY = 1000 # journal records between fsyncs
+VERIFY_PLAN = True # replay re-stats the planned files first and drops actions on files changed since
+PARTIAL_HASH_SIZE = 4096 # bytes read from the start and the end of a file
+HASH_ALGORITHM = "sha256"  # "sha256", "blake2b", "xxhash" or "blake3" (the last two when installed)
+HASH_BUFFER_SIZE = 1024 * 1024
+HASH_MMAP_MIN_SIZE = 64 * 1024 * 1024  # larger files are hashed through mmap
+INDEX_MEMORY_BUDGET = 256 * 1024 * 1024 # bytes of duplicate-index records kept in memory before spilling
+INDEX_SPILL_DIR = None # directory for the spilled runs, None for the system temp directory
+HASH_CACHE_FILE = "hash_cache.sqlite" # kept next to ACTIONS_FILE
+SNAPSHOT_FILE = "scan_snapshot.pickle" # directory listings for incremental mode
+HASH_CACHE_MAX_AGE = 30 * 24 * 3600 # seconds an unused cache entry is kept
+SCAN_JOBS = 1 # walker and hasher threads, 1 scans serially
+HASH_POOL = "thread" # "thread" or "process"
+IO_ENGINE = "threads" # "threads" or "async" (asyncio engine with per-mount limits, for NFS/SMB)
+IO_MOUNT_CONCURRENCY = 64 # async engine: filesystem calls in flight per mount point
+IO_THREADS = 256 # async engine: threads running blocking calls, across all mounts
+USE_DIR_FD = True # run actions relative to open directory descriptors (unlinkat, renameat, fchmodat)
+DIR_FD_CACHE_SIZE = 64 # directories kept open, shared by all threads (at most a quarter of RLIMIT_NOFILE)
+WATCH_DELAY = 1.0 # seconds without events before watch mode rewrites ACTIONS_FILE
 
 MAIN_FOLDER = "../main"
+MOVE_CONFLICT = "suffix" # "suffix" (name_1.ext) or "dedupe" (same content as the taken name is deleted, else suffix)
+MAIN_FOLDER_LAYOUT = "flat" # "flat", "hash" (prefix of a hash of the name), "extension" or "date" (mtime YYYY/MM)
+MAIN_FOLDER_SHARD_WIDTH = 2 # hex characters per directory level of the hash layout
+MAIN_FOLDER_SHARD_LEVELS = 1
+MAIN_FOLDER_FANOUT = 0 # entries per directory before spilling into 0001, 0002, ...; 0 for no limit
+DUPLICATE_ACTION = "delete" # "delete", "hardlink" or "reflink" (falls back to hardlink)
 
+# near_duplicates: text files whose word shingles overlap at least NEAR_DUPLICATE_THRESHOLD.
+# Off by default: every candidate file is read (signatures are cached in the hash cache),
+# and replay never runs this group, its suggestions are reviewed in select or analyze
+NEAR_DUPLICATES = False
+NEAR_DUPLICATE_EXTENSIONS = (".txt", ".md", ".csv", ".log", ".json", ".xml", ".html", ".py")
+NEAR_DUPLICATE_THRESHOLD = 0.8
+NEAR_DUPLICATE_MIN_SIZE = 256
+NEAR_DUPLICATE_MAX_BYTES = 4 * 1024 * 1024  # only the start of larger files is compared
+SHINGLE_WORDS = 4
+MINHASH_SIZE = 64
+LSH_BANDS = 16  # MINHASH_SIZE / LSH_BANDS values per band
+LSH_MAX_BUCKET = 100
+
+# extra rules for the custom_rules group, every condition given must hold, e.g.
+# {"name": "old_logs", "glob": ["*.log", "*.log.?"], "older_than_days": 90, "min_size": 1024,
+#  "action": "delete", "reason": "Log older than 90 days"}
+# other keys: regex (searched in the path), max_size, newer_than_days; action "delete" or "keep"
+CUSTOM_RULES = []
@@ -0,0 +1,127 @@
+import os
+import errno
+import resource
+import threading
+from collections import OrderedDict
+
+
+def fd_budget(size):
+    # at most a quarter of RLIMIT_NOFILE, the rest is left for the files being read and moved
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return size
+    return max(1, min(size, soft // 4))
+
+
+class DirHandles:
+    """Open directory descriptors for the *at calls in execute_action.
+
+    Plans are in walk order, so consecutive actions mostly share a parent
+    directory: it is opened once and looked up again only by name. One LRU
+    of at most `size` descriptors is shared by all threads, whatever their
+    number; a descriptor in use by a call is pinned and never closed under
+    it. When the budget is taken by pinned descriptors, or open() fails
+    with EMFILE after evicting, the call falls back to the full path.
+    """
+
+    def __init__(self, size):
+        self.size = fd_budget(size)
+        self.cache = OrderedDict()  # directory -> [fd, calls using it]
+        self.lock = threading.Lock()
+
+    def _evict(self, keep):
+        # close unpinned descriptors, oldest first, until at most keep are open
+        for directory in [d for d, entry in self.cache.items() if not entry[1]]:
+            if len(self.cache) <= keep:
+                break
+            os.close(self.cache.pop(directory)[0])
+
+    def _acquire(self, directory):
+        with self.lock:
+            entry = self.cache.get(directory)
+            if entry is not None:
+                entry[1] += 1
+                self.cache.move_to_end(directory)
+                return entry[0]
+            self._evict(self.size - 1)
+            if len(self.cache) >= self.size:
+                return None
+        try:
+            fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC)
+        except OSError as e:
+            if e.errno != errno.EMFILE:
+                raise
+            with self.lock:
+                self._evict(0)
+            return None
+        with self.lock:
+            entry = self.cache.get(directory)
+            if entry is not None:
+                # another thread opened it meanwhile
+                os.close(fd)
+            else:
+                entry = self.cache[directory] = [fd, 0]
+            entry[1] += 1
+            return entry[0]
+
+    def _release(self, directory):
+        with self.lock:
+            entry = self.cache.get(directory)
+            if entry is not None:
+                entry[1] -= 1
+
+    def _at(self, path, at_call, path_call):
+        directory, _, name = path.rpartition(os.sep)
+        directory = directory or ("." if not path.startswith(os.sep) else os.sep)
+        fd = self._acquire(directory)
+        if fd is None:
+            return path_call(path)
+        try:
+            return at_call(name, fd)
+        finally:
+            self._release(directory)
+
+    def unlink(self, path):
+        self._at(path, lambda name, fd: os.unlink(name, dir_fd=fd), os.remove)
+
+    def rename(self, path, new_path):
+        # the source directory stays pinned while the destination is looked up
+        self._at(path, lambda name, fd: self._at(
+            new_path,
+            lambda new_name, new_fd: os.rename(name, new_name, src_dir_fd=fd, dst_dir_fd=new_fd),
+            lambda new_path: os.rename(path, new_path)
+        ), lambda path: os.rename(path, new_path))
+
+    def chmod(self, path, mode):
+        self._at(path, lambda name, fd: os.chmod(name, mode, dir_fd=fd), lambda path: os.chmod(path, mode))
+
+    def lexists(self, path):
+        def at_call(name, fd):
+            try:
+                os.stat(name, dir_fd=fd, follow_symlinks=False)
+                return True
+            except FileNotFoundError:
+                return False
+        return self._at(path, at_call, os.path.lexists)
+
+    def close(self):
+        with self.lock:
+            self._evict(0)
+
+
+class PathCalls:
+    """The same calls on full paths, where dir_fd is unsupported or USE_DIR_FD is off."""
+
+    unlink = staticmethod(os.remove)
+    rename = staticmethod(os.rename)
+    chmod = staticmethod(os.chmod)
+    lexists = staticmethod(os.path.lexists)
+
+    def close(self):
+        pass
+
+
+def open_fs_calls(use_dir_fd, size):
+    if use_dir_fd and {os.unlink, os.rename, os.chmod, os.stat} <= os.supports_dir_fd:
+        return DirHandles(size)
+    return PathCalls()
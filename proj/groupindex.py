@@ -0,0 +1,74 @@
+import heapq
+import tempfile
+from itertools import groupby
+
+ID_WIDTH = 8
+
+
+class GroupIndex:
+    """Fixed-width binary keys with integer ids, grouped by sorting.
+
+    Every add() appends one record, the key followed by the id (big-endian),
+    to a bytearray: an entry costs width + 8 bytes instead of a dict slot, a
+    hex string and a list. Once the buffer reaches budget bytes it is sorted
+    and written to a temporary file in spill_dir; groups() merges those runs
+    with what is still in memory. Sorting briefly needs a few times the
+    buffer size, budget should leave room for that.
+    """
+
+    def __init__(self, width, budget, spill_dir=None):
+        self.width = width
+        self.record = width + ID_WIDTH
+        self.budget = max(budget, self.record)
+        self.spill_dir = spill_dir
+        self.buffer = bytearray()
+        self.runs = []
+        self.count = 0
+        self.spills = 0
+
+    def add(self, key, id):
+        self.buffer += key
+        self.buffer += id.to_bytes(ID_WIDTH, "big")
+        self.count += 1
+        if len(self.buffer) >= self.budget:
+            self._spill()
+
+    def _sorted(self):
+        r = self.record
+        data = bytes(self.buffer)
+        self.buffer = bytearray()
+        records = [data[i:i + r] for i in range(0, len(data), r)]
+        records.sort()
+        return records
+
+    def _spill(self):
+        run = tempfile.TemporaryFile(dir=self.spill_dir)
+        run.write(b"".join(self._sorted()))
+        run.seek(0)
+        self.runs.append(run)
+        self.spills += 1
+
+    def _read_run(self, run, chunk_records=65536):
+        r = self.record
+        while data := run.read(r * chunk_records):
+            for i in range(0, len(data), r):
+                yield data[i:i + r]
+
+    def groups(self):
+        """(key, ids) for every key added more than once, in key order, ids ascending."""
+        sources = [self._read_run(run) for run in self.runs]
+        sources.append(iter(self._sorted()))
+        merged = heapq.merge(*sources) if len(sources) > 1 else sources[0]
+        w = self.width
+        try:
+            for key, records in groupby(merged, key=lambda record: record[:w]):
+                ids = [int.from_bytes(record[w:], "big") for record in records]
+                if len(ids) > 1:
+                    yield key, ids
+        finally:
+            self.close()
+
+    def close(self):
+        for run in self.runs:
+            run.close()
+        self.runs = []
@@ -0,0 +1,70 @@
+import os
+import mmap
+import hashlib
+import threading
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+HASHERS = {
+    "sha256": hashlib.sha256,
+    "blake2b": hashlib.blake2b,
+}
+if xxhash is not None:
+    HASHERS["xxhash"] = xxhash.xxh3_128
+if blake3 is not None:
+    HASHERS["blake3"] = blake3.blake3
+
+_buffers = threading.local()
+
+
+def resolve_algorithm(name):
+    # the algorithm actually used, sha256 when the configured one is not installed
+    if name in HASHERS:
+        return name
+    print(f"Hash algorithm {name!r} is not available, using sha256 "
+          f"(available: {', '.join(HASHERS)})")
+    return "sha256"
+
+def _buffer(size):
+    # read buffers are reused per thread, hashing runs on a thread pool
+    by_size = getattr(_buffers, "by_size", None)
+    if by_size is None:
+        by_size = _buffers.by_size = {}
+    if size not in by_size:
+        by_size[size] = bytearray(size)
+    return by_size[size]
+
+def hash_file(path, algorithm, buffer_size, mmap_min_size):
+    """Hex digest of the whole file, read with readinto or mapped when large."""
+    hasher = HASHERS[algorithm]()
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size >= mmap_min_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                hasher.update(mm)
+            return hasher.hexdigest()
+        buf = _buffer(buffer_size)
+        view = memoryview(buf)
+        while n := f.readinto(buf):
+            hasher.update(view[:n])
+    return hasher.hexdigest()
+
+def hash_file_ends(path, length, algorithm):
+    # first and last length bytes, the caller makes sure the file is longer than 2 * length
+    hasher = HASHERS[algorithm]()
+    buf = _buffer(length)
+    view = memoryview(buf)
+    with open(path, "rb") as f:
+        n = f.readinto(buf)
+        hasher.update(view[:n])
+        f.seek(-length, os.SEEK_END)
+        n = f.readinto(buf)
+        hasher.update(view[:n])
+    return hasher.hexdigest()
@@ -0,0 +1,70 @@
+import os
+import json
+
+
+def plan_signature(plan_path):
+    st = os.stat(plan_path)
+    return f"plan {st.st_size} {st.st_mtime_ns} {json.dumps(plan_path)}"
+
+
+class ReplayJournal:
+    """Append-only list of completed action indices for one actions file.
+
+    Lines are "<index>" or "<index> <json path>" for a delete, so the paths
+    deleted before an interruption are known again on resume. Writes are
+    fsync'ed every sync_every records and on close.
+    """
+
+    def __init__(self, path, plan_path, sync_every, restart=False):
+        self.path = path
+        self.sync_every = sync_every
+        self.done = set()
+        self.deleted_paths = set()
+        self.pending = 0
+        header = plan_signature(plan_path)
+        if not restart and self._load(header):
+            self.f = open(path, "a", encoding="utf-8")
+        else:
+            self.f = open(path, "w", encoding="utf-8")
+            self.f.write(header + "\n")
+            self.sync()
+
+    def _load(self, header):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                if f.readline().rstrip("\n") != header:
+                    return False
+                for line in f:
+                    if not line.endswith("\n"):
+                        break  # torn write at the end, that action is not done
+                    index, _, deleted_path = line.rstrip("\n").partition(" ")
+                    self.done.add(int(index))
+                    if deleted_path:
+                        self.deleted_paths.add(json.loads(deleted_path))
+            return True
+        except FileNotFoundError:
+            return False
+        except ValueError as e:
+            print(f"Ignoring damaged journal {self.path}: {e}")
+            return False
+
+    def record(self, index, deleted_path=None):
+        if deleted_path is None:
+            self.f.write(f"{index}\n")
+        else:
+            self.f.write(f"{index} {json.dumps(deleted_path, ensure_ascii=False)}\n")
+        self.pending += 1
+        if self.pending >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.pending = 0
+
+    def close(self, finished=False):
+        # a finished replay needs no journal, the next run starts from the beginning
+        self.sync()
+        self.f.close()
+        if finished:
+            os.remove(self.path)
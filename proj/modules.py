@@ -1,102 +1,379 @@
 import os
 import hashlib
-import stat
-from collections import defaultdict
+import struct
+from collections import Counter, namedtuple
+from itertools import repeat, groupby
+from array import array
 import shutil
 import json
+import time
+import errno
+import fcntl
+import tempfile
+import threading
 from config import TEMP_EXTENSIONS
 from config import BAD_CHARS
 from config import BAD_CHARS, REPLACE_CHAR
 from config import SCAN_DIRS
+from config import SCAN_INCLUDE, SCAN_EXCLUDE, SCAN_MAX_DEPTH, SCAN_MIN_SIZE, SCAN_MAX_SIZE
+from config import SCAN_OLDER_THAN_DAYS, SCAN_NEWER_THAN_DAYS, SCAN_ONE_FILESYSTEM
 from config import DEFAULT_PERMISSIONS, SCAN_DIRS
-from config import ACTIONS_FILE
-from config import MAIN_FOLDER
+from config import ACTIONS_FILE, ACTIONS_JSONL_FILE
+from config import MAIN_FOLDER, MOVE_CONFLICT
+from config import MAIN_FOLDER_LAYOUT, MAIN_FOLDER_SHARD_WIDTH, MAIN_FOLDER_SHARD_LEVELS, MAIN_FOLDER_FANOUT
+from config import PARTIAL_HASH_SIZE
+from config import INDEX_MEMORY_BUDGET, INDEX_SPILL_DIR
+from config import HASH_ALGORITHM, HASH_BUFFER_SIZE, HASH_MMAP_MIN_SIZE
+from config import DUPLICATE_ACTION, CUSTOM_RULES
+from config import USE_DIR_FD, DIR_FD_CACHE_SIZE
+from config import NEAR_DUPLICATES, NEAR_DUPLICATE_EXTENSIONS, NEAR_DUPLICATE_THRESHOLD, NEAR_DUPLICATE_MIN_SIZE
+from config import NEAR_DUPLICATE_MAX_BYTES, SHINGLE_WORDS, MINHASH_SIZE, LSH_BANDS, LSH_MAX_BUCKET
+from parallel import make_executor, bounded_map, parallel_walk
+from hashing import HASHERS, resolve_algorithm, hash_file, hash_file_ends
+from groupindex import GroupIndex
+from similarity import minhash_signature, similarity, similar_clusters
+from rules import RuleSet
+from scope import ScanScope
+from dirfd import open_fs_calls
 
-def is_empty(path):
-    try:
-        return os.path.getsize(path) == 0
-    except OSError:
-        return False
+# config lists compiled once, file_actions runs for every file
+RULES = RuleSet(TEMP_EXTENSIONS, BAD_CHARS, REPLACE_CHAR, DEFAULT_PERMISSIONS, CUSTOM_RULES)
+
+HASH_NAME = resolve_algorithm(HASH_ALGORITHM)
+DIGEST_SIZE = HASHERS[HASH_NAME]().digest_size
+
+# scan scope from config, start.py builds its own when the CLI overrides it
+SCOPE = ScanScope(
+    SCAN_INCLUDE, SCAN_EXCLUDE, SCAN_MAX_DEPTH, SCAN_MIN_SIZE, SCAN_MAX_SIZE,
+    SCAN_OLDER_THAN_DAYS, SCAN_NEWER_THAN_DAYS, SCAN_ONE_FILESYSTEM
+)
+
+# process-wide counters for start.py --stats, walker threads update them under the lock
+scan_counters = Counter()
+scan_errors = Counter()  # errno -> count
+_counters_lock = threading.Lock()
+
+def _count(counts, errnos=()):
+    with _counters_lock:
+        scan_counters.update(counts)
+        scan_errors.update(errnos)
+
+class FileRecord:
+    """Everything the analysis needs about one file, taken from a single stat."""
+    __slots__ = ("path", "name", "dir", "size", "mode", "mtime_ns", "ino", "dev", "nlink")
+
+    def __init__(self, path, name, dir, st):
+        self.path = path
+        self.name = name
+        self.dir = dir
+        self.size = st.st_size
+        self.mode = st.st_mode
+        self.mtime_ns = st.st_mtime_ns
+        self.ino = st.st_ino
+        self.dev = st.st_dev
+        self.nlink = st.st_nlink
+
+    @property
+    def key(self):
+        return (self.dev, self.ino, self.size, self.mtime_ns)
+
+# the stat fields FileRecord reads, for records rebuilt by FileTable
+PackedStat = namedtuple("PackedStat", "st_size st_mtime_ns st_ino st_dev st_nlink st_mode")
+_PACKED = struct.Struct("<QqQQQII")  # PackedStat, then the index of the scan root
+
+class FileTable:
+    """FileRecords packed into one bytearray: the stat fields, the path and an offset.
+
+    A record with its own strings and ints costs a few hundred bytes, a
+    packed one its path and 52 bytes. get(i) builds the record again for
+    the few files the end of a streamed scan still needs.
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = array("Q")
+        self.dirs = []
+        self.dir_index = {}
+
+    def add(self, file):
+        d = self.dir_index.get(file.dir)
+        if d is None:
+            d = self.dir_index[file.dir] = len(self.dirs)
+            self.dirs.append(file.dir)
+        self.offsets.append(len(self.data))
+        self.data += _PACKED.pack(file.size, file.mtime_ns, file.ino, file.dev, file.nlink, file.mode, d)
+        self.data += os.fsencode(file.path)
+        return len(self.offsets) - 1
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def get(self, i):
+        start = self.offsets[i]
+        end = self.offsets[i + 1] if i + 1 < len(self.offsets) else len(self.data)
+        *fields, d = _PACKED.unpack_from(self.data, start)
+        path = os.fsdecode(bytes(self.data[start + _PACKED.size:end]))
+        return FileRecord(path, os.path.basename(path), self.dirs[d], PackedStat(*fields))
+
+def is_empty(file):
+    return file.size == 0
 
 def is_temp(path):
-    return any(path.endswith(ext) for ext in TEMP_EXTENSIONS)
+    return RULES.is_temp(path)
 
 def has_bad_chars(path):
-    name = os.path.basename(path)
-    return any(ch in name for ch in BAD_CHARS)
+    return RULES.has_bad_chars(os.path.basename(path))
 
-def is_nonstandard_permissions(path):
-    try:
-        mode = os.stat(path).st_mode
-        return stat.S_IMODE(mode) != 0o644
-    except OSError:
-        return False
+def is_nonstandard_permissions(file):
+    return RULES.is_nonstandard_permissions(file.mode)
 
 def sanitize_filename(name): # replace chars
-    return ''.join(c if c not in BAD_CHARS else REPLACE_CHAR for c in name)
+    return RULES.sanitize(name)
 
 def get_file_hash(path):
-    hasher = hashlib.sha256()
     try:
-        with open(path, "rb") as f:
-            while chunk := f.read(8192):
-                hasher.update(chunk)
-        return hasher.hexdigest()
-    except OSError:
+        return hash_file(path, HASH_NAME, HASH_BUFFER_SIZE, HASH_MMAP_MIN_SIZE)
+    except OSError as e:
+        _count({}, [e.errno])
+        return None
+
+def get_partial_hash(path, size):
+    # hash of the first and last PARTIAL_HASH_SIZE bytes, small files are hashed whole
+    if size <= 2 * PARTIAL_HASH_SIZE:
+        return get_file_hash(path)
+    try:
+        return hash_file_ends(path, PARTIAL_HASH_SIZE, HASH_NAME)
+    except OSError as e:
+        _count({}, [e.errno])
         return None
 
+def _hash_kind(file, stage):
+    # small files are read whole by the partial hash, so both stages share the full hash;
+    # a partial hash is only comparable with one taken over the same PARTIAL_HASH_SIZE
+    if stage == "full_hash" or file.size <= 2 * PARTIAL_HASH_SIZE:
+        return "full"
+    return f"partial:{PARTIAL_HASH_SIZE}"
+
+def hash_files(files, stage, cache=None, executor=None, stats=None):
+    """Hashes for files in order; cache lookups stay on this thread, reads go to executor."""
+    results = [None] * len(files)
+    todo = []
+    for i, file in enumerate(files):
+        if cache is not None:
+            results[i] = cache.get(file.key, _hash_kind(file, stage))
+        if results[i] is None:
+            todo.append(i)
+
+    paths = [files[i].path for i in todo]
+    if stage == "partial_hash":
+        computed = bounded_map(executor, get_partial_hash, paths, [files[i].size for i in todo])
+    else:
+        computed = bounded_map(executor, get_file_hash, paths)
+    read_limit = 2 * PARTIAL_HASH_SIZE if stage == "partial_hash" else None
+    for i, file_hash in zip(todo, computed):
+        results[i] = file_hash
+        if stats is not None:
+            size = files[i].size
+            stats["bytes_hashed"] = stats.get("bytes_hashed", 0) + (
+                size if read_limit is None or size <= read_limit else read_limit
+            )
+        if cache is not None and file_hash is not None:
+            cache.put(files[i].key, _hash_kind(files[i], stage), file_hash)
+    return results
+
+def _index(width):
+    return GroupIndex(width, INDEX_MEMORY_BUDGET, INDEX_SPILL_DIR)
+
+def _u64(n):
+    return n.to_bytes(8, "big")
+
+def find_duplicates(files, stats=None, cache=None, executor=None, scanned=None):
+    """Group files by content: size first, then partial hash, then full hash (HASH_ALGORITHM).
+
+    Paths sharing an inode are hashed once and kept together: every group
+    is a list of inodes, each given as the list of records naming it.
+    Files are grouped as positions in files with fixed-width binary keys
+    (size, then the raw digest) in a GroupIndex, so nothing is keyed by path
+    or hex digest for every file, and large scans spill to INDEX_SPILL_DIR.
+    files may also be just the files sharing their size with another one,
+    scanned is then the number of files the scan found, for the stats.
+    """
+    stats = stats if stats is not None else {}
+    scanned = scanned if scanned is not None else len(files)
+    stats.setdefault("bytes_hashed", 0)
+    indexes = []
+
+    # other names of an inode, only hard-linked files get an entry
+    by_inode = _index(16)
+    for i, file in enumerate(files):
+        by_inode.add(_u64(file.dev) + _u64(file.ino), i)
+    links = {ids[0]: ids[1:] for _, ids in by_inode.groups()}
+    linked = {i for ids in links.values() for i in ids}
+    indexes.append(by_inode)
+    stats["linked_names"] = len(linked)
+
+    by_size = _index(8)
+    for i, file in enumerate(files):
+        if i not in linked:
+            by_size.add(_u64(file.size), i)
+    candidates = array("Q")
+    for _, ids in by_size.groups():
+        candidates.extend(ids)
+    indexes.append(by_size)
+    stats["removed_by_size"] = by_size.count - len(candidates) + scanned - len(files)
+
+    found = []  # (size + full digest, ids)
+    for stage in ("partial_hash", "full_hash"):
+        left = len(candidates)
+        by_hash = _index(8 + DIGEST_SIZE)
+        todo = [files[i] for i in candidates]
+        for i, file_hash in zip(candidates, hash_files(todo, stage, cache, executor, stats)):
+            if file_hash is not None:
+                by_hash.add(_u64(files[i].size) + bytes.fromhex(file_hash), i)
+        del todo
+        candidates = array("Q")
+        remaining = 0
+        for key, ids in by_hash.groups():
+            remaining += len(ids)
+            # small files were read whole by the partial hash, their groups are final
+            if _hash_kind(files[ids[0]], stage) == "full":
+                found.append((key, ids))
+            else:
+                candidates.extend(ids)
+        indexes.append(by_hash)
+        stats[f"removed_by_{stage}"] = left - remaining
+    stats["scanned"] = scanned
+    stats["duplicates"] = sum(len(ids) for _, ids in found)
+    spills = sum(index.spills for index in indexes)
+    if spills:
+        stats["index_spills"] = stats.get("index_spills", 0) + spills
+    if cache is not None:
+        stats["cache_hits"] = cache.hits
+        stats["cache_misses"] = cache.misses
+
+    # keep the walk order so the result matches hashing every file
+    duplicates = {}
+    for key, ids in sorted(found, key=lambda group: group[1][0]):
+        duplicates[key[8:].hex()] = [[files[i], *(files[j] for j in links.get(i, ()))] for i in ids]
+    stats["reclaimable_bytes"] = sum(
+        s["reclaimable"] for s in suggest_oldest_of_duplicates(duplicates).values()
+    )
+    return duplicates
+
+
+def same_name_groups(files):
+    """name -> records for names shared by more than one file, in walk order.
+
+    Positions are sorted by name instead of building a list per distinct
+    name, only the shared names are kept.
+    """
+    order = sorted(range(len(files)), key=lambda i: files[i].name)
+    groups = []
+    for _, ids in groupby(order, key=lambda i: files[i].name):
+        ids = list(ids)
+        if len(ids) > 1:
+            groups.append(ids)
+    groups.sort(key=lambda ids: ids[0])
+    return {files[ids[0]].name: [files[i] for i in ids] for ids in groups}
 
 def find_same_name_different_mtime(files):
-    name_map = defaultdict(list)
-    for file in files:
-        name_map[file["name"]].append(file)
-    
-    result = {}
-    for name, group in name_map.items():
-        if len(group) > 1:
-            group.sort(key=lambda x: x["mtime"], reverse=True)
-            result[name] = group
+    result = same_name_groups(files)
+    for group in result.values():
+        group.sort(key=lambda x: x.mtime_ns, reverse=True)
     return result
 
+def freed_bytes(names):
+    # removing every name of an inode frees it only if no other link is left outside the scan
+    return names[0].size if len(names) >= names[0].nlink else 0
+
 def suggest_oldest_of_duplicates(duplicates):
+    # other names of the kept inode are already linked to it and need nothing
     result = {}
-    for hash, paths in duplicates.items():
-        sorted_paths = sorted(paths, key=lambda p: os.path.getmtime(p))
+    for hash, group in duplicates.items():
+        sorted_inodes = sorted(group, key=lambda names: names[0].mtime_ns)
         result[hash] = {
-            "keep": sorted_paths[0],
-            "remove": sorted_paths[1:]
+            "keep": sorted_inodes[0][0].path,
+            "keep_file": sorted_inodes[0][0],
+            "remove": [[f.path for f in names] for names in sorted_inodes[1:]],
+            "remove_files": [names[0] for names in sorted_inodes[1:]],
+            "reclaimable": sum(freed_bytes(names) for names in sorted_inodes[1:]),
+            "freed": [freed_bytes(names) for names in sorted_inodes[1:]],
         }
     return result
 
-def scan_directories():
-    
-    
+def list_directory(root, dir, scope=SCOPE):
+    # one directory: its file records and the subdirectories to descend into,
+    # entries outside the scope are dropped here, before any stat where possible
     files = []
-    duplicates = defaultdict(list)
-    
-    for dir in SCAN_DIRS:
-        if not os.path.exists(dir):
-            continue
-        for root, _, filenames in os.walk(dir):
-            for name in filenames:
-                path = os.path.join(root, name)
-                try:
-                    mtime = os.path.getmtime(path)
-                    file_info = {
-                        "path": path,
-                        "name": name,
-                        "mtime": mtime,
-                        "dir": dir
-                    }
-                    files.append(file_info)
-                    
-                    
-                    file_hash = get_file_hash(path)
-                    if file_hash:
-                        duplicates[file_hash].append(path)
-                except OSError:
+    subdirs = []
+    errnos = []
+    pruned = filtered = stated = 0
+    try:
+        with os.scandir(root) as it:
+            entries = list(it)
+    except OSError as e:
+        _count({"dirs_visited": 1}, [e.errno])
+        return files, subdirs
+    depth = root[len(dir):].count(os.sep) + 1  # of the subdirectories found here
+    for entry in entries:
+        try:
+            if entry.is_dir() and not entry.is_symlink():
+                if not scope.wants_dir(entry.name, entry.path, depth) or (
+                        scope.one_filesystem and not scope.same_device(dir, entry.stat(follow_symlinks=False))):
+                    pruned += 1
                     continue
+                subdirs.append(entry.path)
+                continue
+            if entry.is_dir():
+                continue
+            if scope.filters_names and not scope.wants_name(entry.name, entry.path):
+                filtered += 1
+                continue
+            st = entry.stat()
+            stated += 1
+            if scope.filters_stat and not scope.wants_stat(st):
+                filtered += 1
+                continue
+            files.append(FileRecord(entry.path, entry.name, dir, st))
+        except OSError as e:
+            errnos.append(e.errno)
+    counts = {"dirs_visited": 1, "files_stated": stated}
+    if pruned or filtered:
+        counts.update(dirs_pruned=pruned, files_filtered=filtered)
+    _count(counts, errnos)
+    return files, subdirs
+
+def walk_files(root, dir, list_dir=list_directory):
+    # same order as os.walk: files of a directory first, then its subdirectories
+    files, subdirs = list_dir(root, dir)
+    yield from files
+    for subdir in subdirs:
+        yield from walk_files(subdir, dir, list_dir)
+
+def iter_files(jobs=1, list_dir=list_directory, engine=None):
+    # list_dir can be swapped for ScanSnapshot.list_directory in incremental mode
+    roots = [dir for dir in SCAN_DIRS if os.path.exists(dir)]
+    if jobs > 1 or engine is not None:
+        yield from parallel_walk(roots, list_dir, jobs, engine)
+        return
+    for dir in roots:
+        yield from walk_files(dir, dir, list_dir)
+
+def scan_directories(stats=None, cache=None, jobs=1, hash_pool="thread", list_dir=list_directory, engine=None):
+    # engine (aio.IOEngine) takes over both walking and hashing, hash_pool is then unused
+    stats = stats if stats is not None else {}
+    start = time.perf_counter()
+    files = list(iter_files(jobs, list_dir, engine))
+    stats["walk_seconds"] = time.perf_counter() - start
     
+    start = time.perf_counter()
+    executor = engine if engine is not None else make_executor(hash_pool, jobs)
+    try:
+        duplicates = find_duplicates(files, stats, cache, executor)
+    finally:
+        if executor is not None and executor is not engine:
+            executor.shutdown()
+    stats["hash_seconds"] = time.perf_counter() - start
     return files, duplicates
 
 
@@ -122,94 +399,334 @@ def load_actions_from_json():
         print(f"Error loading actions from {ACTIONS_FILE}: {e}")
         return None
 
+def save_actions_to_jsonl(pairs):
+    """Write (group_name, action) pairs to ACTIONS_JSONL_FILE, one line each, as they come.
 
+    move_to_x actions are spilled to a temporary file and written last, once
+    every delete and rename is known, the same way prepare_replay_actions
+    treats the grouped file.
+    """
+    renamed_paths = {}
+    paths_to_delete = set()
+    count = 0
+    tmp_path = ACTIONS_JSONL_FILE + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f, \
+                tempfile.TemporaryFile("w+", encoding="utf-8") as moves:
+            for group_name, action in pairs:
+                if group_name == "move_to_x":
+                    moves.write(json.dumps(action, ensure_ascii=False) + "\n")
+                    continue
+                _retarget(action, renamed_paths)
+                _note_replay_change(group_name, action, renamed_paths, paths_to_delete)
+                f.write(json.dumps({"group": group_name, **action}, ensure_ascii=False) + "\n")
+                count += 1
+            moves.seek(0)
+            planner = MovePlanner()
+            for line in moves:
+                action = _replay_move(json.loads(line), renamed_paths, paths_to_delete, planner)
+                if action is not None:
+                    f.write(json.dumps({"group": "move_to_x", **action}, ensure_ascii=False) + "\n")
+                    count += 1
+        os.replace(tmp_path, ACTIONS_JSONL_FILE)
+        return f"Saved {count} actions to {ACTIONS_JSONL_FILE}"
+    except Exception as e:
+        return f"Error saving actions to {ACTIONS_JSONL_FILE}: {e}"
 
-def analyze_files(files, duplicates):
-    
-    
-    grouped_actions = {
+def load_actions_from_jsonl(skip=frozenset()):
+    # lazy (index, group_name, action) iterator, None when there is no file;
+    # lines whose index is in skip are not parsed
+    if not os.path.exists(ACTIONS_JSONL_FILE):
+        return None
+
+    def read():
+        index = 0
+        with open(ACTIONS_JSONL_FILE, "r", encoding="utf-8") as f:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                index += 1
+                if index - 1 in skip:
+                    continue
+                try:
+                    action = json.loads(line)
+                except ValueError as e:
+                    print(f"Error loading line {number} of {ACTIONS_JSONL_FILE}: {e}")
+                    continue
+                yield index - 1, action.pop("group", None), action
+    return read()
+
+
+
+def expect(file):
+    # what the file looked like when the plan was made, checked again by verify.py before replay
+    return {"size": file.size, "mtime_ns": file.mtime_ns, "ino": file.ino}
+
+# groups replay leaves out, their suggestions need a person to confirm them
+REVIEW_GROUPS = ("near_duplicates",)
+
+def new_grouped_actions():
+    return {
         "empty": [],
         "temporary": [],
         "bad_chars": [],
         "nonstandard_perms": [],
         "same_name": [],
         "duplicates": [],
+        "near_duplicates": [],
+        "custom_rules": [],
         "move_to_x": []
     }
+
+def file_actions(file):
+    """Per-file rules, yields (group_name, action) for a single FileRecord."""
+    if is_empty(file):
+        yield "empty", {
+            "path": file.path,
+            "action": "delete",
+            "reason": "Empty file",
+            "expect": expect(file),
+        }
+        return
+
+    if RULES.is_temp(file.path):
+        yield "temporary", {
+            "path": file.path,
+            "action": "delete",
+            "reason": "Temporary file",
+            "expect": expect(file),
+        }
+
+    if RULES.has_bad_chars(file.name):
+        new_name = RULES.sanitize(file.name)
+        new_path = os.path.join(os.path.dirname(file.path), new_name)
+        yield "bad_chars", {
+            "path": file.path,
+            "action": "rename",
+            "new_path": new_path,
+            "reason": "Problematic characters in name",
+            "expect": expect(file),
+        }
+
+    if RULES.is_nonstandard_permissions(file.mode):
+        yield "nonstandard_perms", {
+            "path": file.path,
+            "action": "chmod",
+            "new_mode": DEFAULT_PERMISSIONS,
+            "reason": "Non-standard permissions",
+            "expect": expect(file),
+        }
+
+    rule = RULES.custom_match(file) if RULES.custom else None
+    if rule is not None:
+        yield "custom_rules", {
+            "path": file.path,
+            "action": rule.action,
+            "reason": rule.reason,
+            "rule": rule.name,
+            "expect": expect(file),
+        }
+
+    if file.dir != MAIN_FOLDER:
+        new_path = os.path.join(MAIN_FOLDER, main_folder_shard(file.name, file.mtime_ns), file.name)
+        yield "move_to_x", {
+            "path": file.path,
+            "action": "move",
+            "new_path": new_path,
+            "reason": f"Move to {MAIN_FOLDER}",
+            "expect": expect(file),
+        }
+
+def same_name_actions(name_map):
+    # name_map: name -> [FileRecord] in scan order
+    for name, group in name_map.items():
+        if len(group) < 2:
+            continue
+        group.sort(key=lambda f: f.mtime_ns, reverse=True)
+        for file in group[1:]:
+            yield "same_name", {
+                "path": file.path,
+                "action": "delete",
+                "reason": f"Older version of {name}, newer exists at {group[0].path}",
+                "expect": expect(file),
+                "target": group[0].path,
+                "target_expect": expect(group[0]),
+            }
+
+def duplicate_actions(duplicates):
+    duplicate_suggestions = suggest_oldest_of_duplicates(duplicates)
+    for hash, suggestion in duplicate_suggestions.items():
+        remove = zip(suggestion["remove"], suggestion["remove_files"], suggestion["freed"])
+        for paths, file, freed in remove:
+            action = {
+                "path": paths[0],
+                "action": DUPLICATE_ACTION,
+                "reason": f"Duplicate of {suggestion['keep']}",
+                "reclaimable_bytes": freed,
+                "hash": hash,
+                "hash_algorithm": HASH_NAME,
+                "expect": expect(file),
+                "target": suggestion["keep"],
+                "target_expect": expect(suggestion["keep_file"]),
+            }
+            if len(paths) > 1:
+                # other names of the same inode, handled together with path
+                action["links"] = paths[1:]
+            yield "duplicates", action
+
+def is_near_duplicate_candidate(file):
+    return file.size >= NEAR_DUPLICATE_MIN_SIZE and file.name.lower().endswith(NEAR_DUPLICATE_EXTENSIONS)
+
+def near_duplicate_actions(files, duplicates, stats=None, executor=None, cache=None):
+    """Text files that differ only a little, the newest of each cluster is kept.
+
+    Only with NEAR_DUPLICATES on. Copies already handled by the duplicates
+    group and extra names of one inode are left out, only the start of a
+    file (NEAR_DUPLICATE_MAX_BYTES) is compared. Signatures are kept in the
+    hash cache next to the file hashes, so an unchanged file is not read again.
+    """
+    if not NEAR_DUPLICATES:
+        return
+    stats = stats if stats is not None else {}
+    handled = set()
+    for suggestion in suggest_oldest_of_duplicates(duplicates).values():
+        for paths in suggestion["remove"]:
+            handled.update(paths)
+    candidates = {}
+    for file in files:
+        if is_near_duplicate_candidate(file) and file.path not in handled:
+            candidates.setdefault((file.dev, file.ino), file)
+    candidates = list(candidates.values())
+
+    kind = f"minhash:{MINHASH_SIZE}:{SHINGLE_WORDS}:{NEAR_DUPLICATE_MAX_BYTES}"
+    found = [None] * len(candidates)
+    todo = []
+    for i, file in enumerate(candidates):
+        cached = cache.get(file.key, kind) if cache is not None else None
+        if cached is not None:
+            found[i] = array("I", bytes.fromhex(cached))
+        else:
+            todo.append(i)
+    computed = bounded_map(
+        executor, minhash_signature, [candidates[i].path for i in todo],
+        repeat(MINHASH_SIZE), repeat(SHINGLE_WORDS), repeat(NEAR_DUPLICATE_MAX_BYTES)
+    )
+    for i, signature in zip(todo, computed):
+        found[i] = signature
+        if cache is not None and signature is not None:
+            cache.put(candidates[i].key, kind, signature.tobytes().hex())
+    if cache is not None:
+        stats["cache_hits"] = cache.hits
+        stats["cache_misses"] = cache.misses
+
+    signatures = []
+    signed = []
+    for file, signature in zip(candidates, found):
+        if signature is not None:
+            signatures.append(signature)
+            signed.append(file)
+    clusters, skipped = similar_clusters(signatures, LSH_BANDS, NEAR_DUPLICATE_THRESHOLD, LSH_MAX_BUCKET)
+    stats["near_duplicate_candidates"] = len(signed)
+    stats["lsh_buckets_skipped"] = skipped
+
+    for cluster in clusters:
+        cluster.sort(key=lambda i: signed[i].mtime_ns, reverse=True)
+        keep = cluster[0]
+        for i in cluster[1:]:
+            # clusters can chain, only files close enough to the kept one are suggested
+            score = similarity(signatures[keep], signatures[i])
+            if score >= NEAR_DUPLICATE_THRESHOLD:
+                yield "near_duplicates", {
+                    "path": signed[i].path,
+                    "action": "delete",
+                    "reason": f"Near duplicate ({score:.0%} similar) of newer {signed[keep].path}",
+                    "expect": expect(signed[i]),
+                    "target": signed[keep].path,
+                    "target_expect": expect(signed[keep]),
+                }
+
+def group_actions(pairs):
+    grouped_actions = new_grouped_actions()
+    for group_name, action in pairs:
+        grouped_actions[group_name].append(action)
+    return grouped_actions
+
+def _grouped_ids(index):
+    # positions of every file in a group of index, in walk order
+    ids = array("Q")
+    for _, group in index.groups():
+        ids.extend(group)
+    return sorted(ids)
+
+def stream_actions(files, stats=None, cache=None, executor=None):
+    """Yield (group_name, action) while files come in.
+
+    Per-file rules are emitted immediately. The records are not kept:
+    each file is packed into a FileTable and its size and name (a 16-byte
+    digest) go into GroupIndexes. At the end of the scan only the files
+    sharing a size or a name with another one, and the near-duplicate
+    candidates, are rebuilt for same-name and duplicate grouping.
+    """
+    stats = stats if stats is not None else {}
+    table = FileTable()
+    by_size = _index(8)
+    by_name = _index(16)
+    near = array("Q")
+    for file in files:
+        yield from file_actions(file)
+        i = table.add(file)
+        by_size.add(_u64(file.size), i)
+        if not is_empty(file):
+            by_name.add(hashlib.blake2b(os.fsencode(file.name), digest_size=16).digest(), i)
+        if NEAR_DUPLICATES and is_near_duplicate_candidate(file):
+            near.append(i)
+    spills = by_size.spills + by_name.spills
+    if spills:
+        stats["index_spills"] = stats.get("index_spills", 0) + spills
+
+    # names hashing alike but differing are told apart again by same_name_groups
+    named = [table.get(i) for i in _grouped_ids(by_name)]
+    yield from same_name_actions(same_name_groups(named))
+    del named
+    sized = [table.get(i) for i in _grouped_ids(by_size)]
+    duplicates = find_duplicates(sized, stats, cache, executor, scanned=len(table))
+    del sized
+    yield from duplicate_actions(duplicates)
+    yield from near_duplicate_actions((table.get(i) for i in near), duplicates, stats, executor, cache)
+
+def scan_actions(stats=None, cache=None, jobs=1, hash_pool="thread", list_dir=list_directory, engine=None):
+    """Streaming counterpart of scan_directories + analyze_files."""
+    executor = engine if engine is not None else make_executor(hash_pool, jobs)
+    try:
+        yield from stream_actions(iter_files(jobs, list_dir, engine), stats, cache, executor)
+    finally:
+        if executor is not None and executor is not engine:
+            executor.shutdown()
+
+def analyze_files(files, duplicates, stats=None, executor=None, cache=None):
+    
+    
+    grouped_actions = new_grouped_actions()
     
    
     non_empty_files = []
     for file in files:
-        if is_empty(file["path"]):
-            grouped_actions["empty"].append({
-                "path": file["path"],
-                "action": "delete",
-                "reason": "Empty file"
-            })
-        else:
+        for group_name, action in file_actions(file):
+            grouped_actions[group_name].append(action)
+        if not is_empty(file):
             non_empty_files.append(file)
     
-    
-    for file in non_empty_files:
-        
-        if is_temp(file["path"]):
-            grouped_actions["temporary"].append({
-                "path": file["path"],
-                "action": "delete",
-                "reason": "Temporary file"
-            })
-        
-        
-       
-        
-       
-        if is_nonstandard_permissions(file["path"]):
-            grouped_actions["nonstandard_perms"].append({
-                "path": file["path"],
-                "action": "chmod",
-                "new_mode": DEFAULT_PERMISSIONS,
-                "reason": "Non-standard permissions"
-            })
-
-        if has_bad_chars(file["path"]):
-            new_name = sanitize_filename(file["name"])
-            new_path = os.path.join(os.path.dirname(file["path"]), new_name)
-            grouped_actions["bad_chars"].append({
-                "path": file["path"],
-                "action": "rename",
-                "new_path": new_path,
-                "reason": "Problematic characters in name"
-            })
-        
-        
-        if file["dir"] != MAIN_FOLDER:  
-            new_path = os.path.join(MAIN_FOLDER, file["name"])
-            grouped_actions["move_to_x"].append({
-                "path": file["path"],
-                "action": "move",
-                "new_path": new_path,
-                "reason": f"Move to {MAIN_FOLDER}"
-            })
-    
    
     same_name_groups = find_same_name_different_mtime(non_empty_files)
-    for name, group in same_name_groups.items():
-        for i, file in enumerate(group[1:], 1):
-            grouped_actions["same_name"].append({
-                "path": file["path"],
-                "action": "delete",
-                "reason": f"Older version of {name}, newer exists at {group[0]['path']}"
-            })
+    for group_name, action in same_name_actions(same_name_groups):
+        grouped_actions[group_name].append(action)
     
     
-    duplicate_suggestions = suggest_oldest_of_duplicates(duplicates)
-    for hash, suggestion in duplicate_suggestions.items():
-        for path in suggestion["remove"]:
-            grouped_actions["duplicates"].append({
-                "path": path,
-                "action": "delete",
-                "reason": f"Duplicate of {suggestion['keep']}"
-            })
+    for group_name, action in duplicate_actions(duplicates):
+        grouped_actions[group_name].append(action)
+
+    for group_name, action in near_duplicate_actions(files, duplicates, stats, executor, cache):
+        grouped_actions[group_name].append(action)
     
     
 
@@ -217,22 +734,277 @@ def analyze_files(files, duplicates):
 
 
 
+def _note_replay_change(group_name, action, renamed_paths, paths_to_delete):
+    # Tworzenie mapowania nowych nazw dla grupy bad_chars
+    if group_name == "bad_chars" and action["action"] == "rename" and action.get("new_path"):
+        renamed_paths[action["path"]] = action["new_path"]
+    # Zbieranie ścieżek plików do usunięcia z grup temporary, duplicates itp.
+    # (near_duplicates nie, replay ich nie wykonuje)
+    if group_name in ["temporary", "same_name", "duplicates", "custom_rules", "empty"] and action["action"] == "delete":
+        paths_to_delete.add(action["path"])
+        paths_to_delete.update(action.get("links", ()))
+
+def _retarget(action, renamed_paths):
+    # a kept copy or another name of a duplicate renamed earlier in the plan goes by the new name
+    if action.get("target"):
+        action["target"] = renamed_paths.get(action["target"], action["target"])
+    if action.get("links"):
+        action["links"] = [renamed_paths.get(p, p) for p in action["links"]]
+
+def main_folder_shard(name, mtime_ns=None):
+    """Subdirectory of MAIN_FOLDER for a file under MAIN_FOLDER_LAYOUT, "" when flat."""
+    if MAIN_FOLDER_LAYOUT == "hash":
+        digest = hashlib.blake2b(os.fsencode(name), digest_size=16).hexdigest()
+        width = MAIN_FOLDER_SHARD_WIDTH
+        return os.path.join(*(digest[i * width:(i + 1) * width] for i in range(MAIN_FOLDER_SHARD_LEVELS)))
+    if MAIN_FOLDER_LAYOUT == "extension":
+        return os.path.splitext(name)[1].lstrip(".").lower() or "no_extension"
+    if MAIN_FOLDER_LAYOUT == "date":
+        if mtime_ns is None:
+            return "unknown_date"
+        return time.strftime(os.path.join("%Y", "%m"), time.localtime(mtime_ns / 1e9))
+    return ""
+
+class MovePlanner:
+    """Destinations in MAIN_FOLDER for move_to_x, no two moves land on one name.
+
+    The directory comes from main_folder_shard; once it holds
+    MAIN_FOLDER_FANOUT entries the next ones go to numbered subdirectories
+    (0001, 0002, ...). Names already on disk and names handed out earlier
+    are taken; a move onto a taken name gets a _1, _2, ... suffix, or with
+    MOVE_CONFLICT "dedupe" becomes a delete when its content equals the
+    file holding the name. Moves within one filesystem are marked same_fs,
+    execute_action does them with a single os.rename.
+    """
+
+    def __init__(self, main_folder=None, on_conflict=None, fanout=None):
+        # resolved here rather than as defaults, so a patched modules.MAIN_FOLDER is honoured
+        self.main_folder = MAIN_FOLDER if main_folder is None else main_folder
+        self.on_conflict = MOVE_CONFLICT if on_conflict is None else on_conflict
+        self.fanout = MAIN_FOLDER_FANOUT if fanout is None else fanout
+        # taken path relative to main_folder -> paths of the file holding it, in the
+        # order it goes by them: after renames, before them, moved (the last one)
+        self.holders = {}
+        self.counts = {}  # directory relative to main_folder -> entries, listed on first use
+        self.spill = {}  # shard -> number of the subdirectory being filled
+        self.next_suffix = {}
+        self.main_dev = self._device(self.main_folder)
+        self.dir_devs = {}
+
+    def _device(self, path):
+        # MAIN_FOLDER may not exist yet, its nearest existing parent decides
+        path = os.path.abspath(path)
+        while True:
+            try:
+                return os.stat(path).st_dev
+            except OSError:
+                parent = os.path.dirname(path)
+                if parent == path:
+                    return None
+                path = parent
+
+    def _load(self, directory):
+        if directory in self.counts:
+            return
+        count = 0
+        try:
+            with os.scandir(os.path.join(self.main_folder, directory)) as it:
+                for entry in it:
+                    self.holders[os.path.join(directory, entry.name)] = (entry.path,)
+                    count += 1
+        except OSError:
+            pass
+        self.counts[directory] = count
+
+    def _directory(self, shard):
+        n = self.spill.get(shard, 0)
+        while True:
+            directory = os.path.join(shard, f"{n:04d}") if n else shard
+            self._load(directory)
+            if not self.fanout or self.counts[directory] < self.fanout:
+                self.spill[shard] = n
+                return directory
+            n += 1
+
+    def _unique(self, directory, name):
+        stem, ext = os.path.splitext(name)
+        key = (directory, name)
+        n = self.next_suffix.get(key, 1)
+        while os.path.join(directory, f"{stem}_{n}{ext}") in self.holders:
+            n += 1
+        self.next_suffix[key] = n + 1
+        return f"{stem}_{n}{ext}"
+
+    def plan(self, action, path):
+        """The action to run for moving path, which is action["path"] after renames."""
+        name = os.path.basename(path)
+        mtime_ns = action.get("expect", {}).get("mtime_ns")
+        if MAIN_FOLDER_LAYOUT == "date" and mtime_ns is None:
+            # plans saved without a fingerprint: stat the file, which still
+            # has its old name when the plan is written
+            for candidate in (path, action["path"]):
+                try:
+                    mtime_ns = os.stat(candidate).st_mtime_ns
+                    break
+                except OSError:
+                    pass
+        directory = self._directory(main_folder_shard(name, mtime_ns))
+        holder = self.holders.get(os.path.join(directory, name))
+        if holder is not None:
+            if self.on_conflict == "dedupe" and _same_content((path, action["path"]), holder):
+                deleted = {k: v for k, v in action.items() if k != "new_path"}
+                return {**deleted, "path": path, "action": "delete",
+                        "reason": f"Same content as {holder[-1]}, already in {self.main_folder}"}
+            name = self._unique(directory, name)
+        relative = os.path.join(directory, name)
+        new_path = os.path.join(self.main_folder, relative)
+        self.holders[relative] = (path, action["path"], new_path)
+        self.counts[directory] += 1
+        updated_action = {**action, "path": path, "action": "move", "new_path": new_path}
+        source_dir = os.path.dirname(path)
+        if source_dir not in self.dir_devs:
+            self.dir_devs[source_dir] = self._device(source_dir)
+        if self.main_dev is not None and self.dir_devs[source_dir] == self.main_dev:
+            updated_action["same_fs"] = True
+        return updated_action
+
+def _existing(paths):
+    return next((p for p in paths if os.path.lexists(p)), None)
+
+def _same_content(paths, holder):
+    # both sides are given by every name they may have now: while a plan is
+    # written the renames before the move have not run yet, in auto, select and
+    # analyze they have, and the holder's own move may have too
+    path, other = _existing(paths), _existing(holder)
+    if path is None or other is None:
+        return False
+    try:
+        return files_equal(path, other)
+    except OSError:
+        return False
+
+def _replay_move(action, renamed_paths, paths_to_delete, moves):
+    current_path = renamed_paths.get(action["path"], action["path"])
+    # Pomijamy pliki, które są sugerowane do usunięcia
+    if current_path in paths_to_delete:
+        return None
+    return moves.plan(action, current_path)
+
+def prepare_replay_actions(grouped_actions):
+    """Point move_to_x at renamed paths and drop moves of files that will be deleted."""
+    renamed_paths = {}
+    paths_to_delete = set()
+    for group_name, actions in grouped_actions.items():
+        if group_name != "move_to_x":
+            for action in actions:
+                _retarget(action, renamed_paths)
+                _note_replay_change(group_name, action, renamed_paths, paths_to_delete)
+
+    # Aktualizacja grupy move_to_x
+    if "move_to_x" in grouped_actions:
+        moves = MovePlanner()
+        updated_actions = []
+        for action in grouped_actions["move_to_x"]:
+            updated_action = _replay_move(action, renamed_paths, paths_to_delete, moves)
+            if updated_action is not None:
+                updated_actions.append(updated_action)
+        grouped_actions["move_to_x"] = updated_actions
+
+    return grouped_actions
+
+
+
+FICLONE = 0x40049409  # _IOW(0x94, 9, int) from <linux/fs.h>
+REFLINK_UNSUPPORTED = {errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EXDEV, errno.EBADF}
+
+def files_equal(path, other, chunk_size=1024 * 1024):
+    with open(path, "rb") as a, open(other, "rb") as b:
+        if os.fstat(a.fileno()).st_size != os.fstat(b.fileno()).st_size:
+            return False
+        while True:
+            chunk = a.read(chunk_size)
+            if chunk != b.read(chunk_size):
+                return False
+            if not chunk:
+                return True
+
+def _reflink(target, tmp_path):
+    with open(target, "rb") as src, open(tmp_path, "xb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+def link_duplicate(path, target, kind):
+    """Replace path with a hardlink or reflink of target, returns the kind actually used.
+
+    The content is compared byte by byte first. The link is made under a
+    temporary name in the same directory and renamed over path, so path is
+    never missing. A reflink that the filesystem does not support falls
+    back to a hardlink.
+    """
+    if os.path.samefile(path, target):
+        return "already linked"
+    if not files_equal(path, target):
+        raise ValueError(f"content differs from {target}")
+    tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.{os.getpid()}.link")
+    try:
+        if kind == "reflink":
+            try:
+                _reflink(target, tmp_path)
+                shutil.copystat(path, tmp_path)
+            except OSError as e:
+                if e.errno not in REFLINK_UNSUPPORTED:
+                    raise
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                kind = "hardlink"
+        if kind == "hardlink":
+            os.link(target, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return kind
+
+def _links_note(action):
+    links = action.get("links")
+    return f" (and {len(links)} other names of the same file)" if links else ""
+
+# unlink/rename/chmod through open parent directories (the *at calls), see dirfd.py
+FS = open_fs_calls(USE_DIR_FD, DIR_FD_CACHE_SIZE)
+
 def execute_action(action):
     """Execute the specified action on a file."""
     try:
         if action["action"] == "delete":
-            os.remove(action["path"])
-            return f"Deleted: {action['path']}"
+            for path in [action["path"], *action.get("links", ())]:
+                FS.unlink(path)
+            return f"Deleted: {action['path']}" + _links_note(action)
         elif action["action"] == "move":
             os.makedirs(os.path.dirname(action["new_path"]), exist_ok=True)
+            if FS.lexists(action["new_path"]):
+                # planned names are unique, something else took it since
+                raise FileExistsError(errno.EEXIST, "destination exists", action["new_path"])
+            if action.get("same_fs"):
+                try:
+                    FS.rename(action["path"], action["new_path"])
+                    return f"Moved: {action['path']} to {action['new_path']}"
+                except OSError as e:
+                    if e.errno != errno.EXDEV:
+                        raise
             shutil.move(action["path"], action["new_path"])
             return f"Moved: {action['path']} to {action['new_path']}"
         elif action["action"] == "rename":
-            os.rename(action["path"], action["new_path"])
+            FS.rename(action["path"], action["new_path"])
             return f"Renamed: {action['path']} to {action['new_path']}"
         elif action["action"] == "chmod":
-            os.chmod(action["path"], action["new_mode"])
+            FS.chmod(action["path"], action["new_mode"])
             return f"Changed permissions: {action['path']} to {DEFAULT_PERMISSIONS}"
+        elif action["action"] in ("hardlink", "reflink"):
+            for path in [action["path"], *action.get("links", ())]:
+                used = link_duplicate(path, action["target"], action["action"])
+            if used == "already linked":
+                return f"Kept unchanged: {action['path']} is already linked to {action['target']}"
+            return f"Linked ({used}): {action['path']} to {action['target']}" + _links_note(action)
         elif action["action"] == "keep":
             return f"Kept unchanged: {action['path']}"
         else:
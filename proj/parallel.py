@@ -0,0 +1,82 @@
+import heapq
+from collections import Counter, deque
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+
+def make_executor(kind, jobs):
+    """Pool for hashing, None means hash on the calling thread."""
+    if jobs <= 1:
+        return None
+    if kind == "process":
+        return ProcessPoolExecutor(jobs)
+    return ThreadPoolExecutor(jobs)
+
+def bounded_map(executor, func, *iterables, window=256):
+    # like executor.map, but keeps at most window tasks in flight
+    if executor is None:
+        yield from map(func, *iterables)
+        return
+    in_flight = deque()
+    for args in zip(*iterables):
+        in_flight.append(executor.submit(func, *args))
+        if len(in_flight) >= window:
+            yield in_flight.popleft().result()
+    while in_flight:
+        yield in_flight.popleft().result()
+
+def parallel_walk(roots, list_directory, jobs, executor=None, window=256):
+    """List directories on a thread pool and yield the files in os.walk order.
+
+    list_directory(path, root) returns (files, subdirs). Directories are
+    listed on the shared pool in walk order, so idle workers pick up work
+    from whichever root still has directories left. A directory's files are
+    yielded as soon as it and everything before it in walk order is listed;
+    new directories are only submitted while fewer than window listings
+    wait for one before them. executor (an IOEngine) replaces the pool of
+    jobs threads.
+    """
+    listings = {}
+    walks = Counter(roots)  # a root given twice is walked twice
+    later = walks.copy()  # walks of each root still to start
+    order = deque(roots)
+    stack = []  # (root, path) still to yield, next on top
+    ahead = 0  # listings done but not yielded yet
+
+    def listed():
+        nonlocal ahead
+        while stack or order:
+            if not stack:
+                root = order.popleft()
+                later[root] -= 1
+                stack.append((root, root))
+            root, path = stack[-1]
+            if (root, path) not in listings:
+                return
+            stack.pop()
+            # kept for the next walk of the same root
+            files, subdirs = listings[root, path] if later[root] else listings.pop((root, path))
+            if later[root] == walks[root] - 1:
+                ahead -= 1
+            yield from files
+            stack.extend((root, subdir) for subdir in reversed(subdirs))
+
+    slots = 2 * (jobs if executor is None else getattr(executor, "capacity", jobs))
+    # heap of (position in walk order, path, root), the position is the index of every step from the root
+    waiting = [((i,), root, root) for i, root in enumerate(dict.fromkeys(roots))]
+    with (ThreadPoolExecutor(jobs) if executor is None else nullcontext(executor)) as pool:
+        pending = {}
+        while waiting or pending:
+            # with nothing in flight the first waiting directory is the one yielded next
+            while waiting and len(pending) < slots and (ahead < window or not pending):
+                position, path, root = heapq.heappop(waiting)
+                pending[pool.submit(list_directory, path, root)] = (position, path, root)
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                position, path, root = pending.pop(future)
+                files, subdirs = future.result()
+                listings[root, path] = (files, subdirs)
+                ahead += 1
+                for i, subdir in enumerate(subdirs):
+                    heapq.heappush(waiting, (position + (i,), subdir, root))
+            yield from listed()
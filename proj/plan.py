@@ -0,0 +1,54 @@
+class ActionPlan:
+    """Grouped actions plus the renames and deletes done so far, keyed by path.
+
+    Renames form chains (a -> b, later b -> c); current() follows a chain to
+    its end and points every path it passed straight at the end, union-find
+    style, so repeated lookups stay constant time. A delete is recorded for
+    the path as it is at that moment, together with the group it happened in,
+    so a later action on the same file in any group is skipped with one
+    lookup instead of filtering the groups.
+    """
+
+    def __init__(self, grouped_actions):
+        self.groups = grouped_actions
+        self.order = {name: i for i, name in enumerate(grouped_actions)}
+        self.renamed = {}  # path -> the name it was renamed to
+        self.deleted = {}  # current path -> order of the group that deleted it
+
+    def current(self, path):
+        end = path
+        while end in self.renamed:
+            end = self.renamed[end]
+        while path != end:
+            self.renamed[path], path = end, self.renamed[path]
+        return end
+
+    def rename(self, path, new_path):
+        path = self.current(path)
+        if path != new_path:
+            self.renamed[path] = new_path
+
+    def delete(self, path, group_name):
+        self.deleted[self.current(path)] = self.order.get(group_name, len(self.order))
+
+    def is_deleted(self, path):
+        return self.current(path) in self.deleted
+
+    def note_result(self, group_name, action, result):
+        # bookkeeping after execute_action, for the path the action ran on
+        if result.startswith("Deleted:"):
+            for path in [action["path"], *action.get("links", ())]:
+                self.delete(path, group_name)
+        elif result.startswith("Renamed:"):
+            self.rename(action["path"], action["new_path"])
+
+    def remaining(self):
+        """Grouped actions without files deleted up to and including their group."""
+        last = len(self.order)
+        return {
+            group_name: [
+                a for a in actions
+                if self.deleted.get(self.current(a["path"]), last) > self.order[group_name]
+            ]
+            for group_name, actions in self.groups.items()
+        }
@@ -0,0 +1,87 @@
+import re
+import json
+import time
+import errno
+from collections import Counter
+from contextlib import contextmanager
+
+ERRNO_IN_RESULT = re.compile(r"\[Errno (\d+)\]")
+
+
+def errno_name(code):
+    return errno.errorcode.get(code, str(code))
+
+def result_errno(result):
+    # execute_action reports failures as text, the errno is inside the exception message
+    if not result.startswith("Error"):
+        return None
+    match = ERRNO_IN_RESULT.search(result)
+    return errno_name(int(match.group(1))) if match else "other"
+
+
+class RunStats:
+    """Per-phase timers and counters for one start.py run (--stats)."""
+
+    def __init__(self):
+        self.phases = {}
+        self.counters = Counter()
+        self.errors = Counter()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def add_scan(self, scan_stats):
+        for key, value in scan_stats.items():
+            if key.endswith("_seconds"):
+                self.add_time(key[:-len("_seconds")], value)
+            elif key == "errors":
+                self.errors.update(value)
+            else:
+                self.counters[key] += value
+
+    def note_result(self, result):
+        self.counters["actions_executed"] += 1
+        code = result_errno(result)
+        if code is not None:
+            self.errors[code] += 1
+
+    def as_dict(self):
+        executed = self.counters.get("actions_executed", 0)
+        execute_seconds = self.phases.get("execute", 0.0)
+        return {
+            "phases": {name: round(seconds, 4) for name, seconds in self.phases.items()},
+            "counters": dict(self.counters),
+            "actions_per_second": round(executed / execute_seconds) if execute_seconds else None,
+            "errors": dict(self.errors),
+        }
+
+    def report(self):
+        data = self.as_dict()
+        print("\n=== Run statistics ===")
+        total = sum(self.phases.values())
+        for name, seconds in self.phases.items():
+            share = seconds / total * 100 if total else 0
+            print(f"{name:<28} {seconds:>10.3f}s {share:>6.1f}%")
+        print("-" * 50)
+        for name, value in sorted(self.counters.items()):
+            print(f"{name:<28} {value:>12}")
+        if data["actions_per_second"] is not None:
+            print(f"{'actions/s':<28} {data['actions_per_second']:>12}")
+        for code, count in sorted(self.errors.items()):
+            print(f"{'errors ' + code:<28} {count:>12}")
+
+    def save(self, path):
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(self.as_dict(), f, indent=4)
+            return f"Saved run statistics to {path}"
+        except Exception as e:
+            return f"Error saving run statistics to {path}: {e}"
@@ -0,0 +1,84 @@
+import re
+import stat
+import time
+import fnmatch
+
+
+class Rule:
+    """One declarative rule from CUSTOM_RULES, every given condition must hold.
+
+    Keys: name, reason, action ("delete" or "keep"), glob (one pattern or a
+    list, matched against the file name), regex (searched in the path),
+    min_size / max_size (bytes), older_than_days / newer_than_days (mtime).
+    """
+
+    def __init__(self, spec, now):
+        self.name = spec["name"]
+        self.action = spec.get("action", "delete")
+        if self.action not in ("delete", "keep"):
+            raise ValueError(f"rule {self.name}: unsupported action {self.action!r}")
+        self.reason = spec.get("reason", f"Matches rule {self.name}")
+        globs = spec.get("glob", [])
+        if isinstance(globs, str):
+            globs = [globs]
+        # all globs of a rule become one regex, so a file costs one match
+        self.glob = re.compile("|".join(fnmatch.translate(g) for g in globs)) if globs else None
+        self.regex = re.compile(spec["regex"]) if "regex" in spec else None
+        self.min_size = spec.get("min_size")
+        self.max_size = spec.get("max_size")
+        day_ns = 24 * 3600 * 10**9
+        self.mtime_before = now - spec["older_than_days"] * day_ns if "older_than_days" in spec else None
+        self.mtime_after = now - spec["newer_than_days"] * day_ns if "newer_than_days" in spec else None
+
+    def matches(self, file):
+        # cheap integer checks first, regexes last
+        if self.min_size is not None and file.size < self.min_size:
+            return False
+        if self.max_size is not None and file.size > self.max_size:
+            return False
+        if self.mtime_before is not None and file.mtime_ns >= self.mtime_before:
+            return False
+        if self.mtime_after is not None and file.mtime_ns <= self.mtime_after:
+            return False
+        if self.glob is not None and not self.glob.match(file.name):
+            return False
+        if self.regex is not None and not self.regex.search(file.path):
+            return False
+        return True
+
+
+class RuleSet:
+    """The per-file predicates, compiled once from config."""
+
+    def __init__(self, temp_extensions, bad_chars, replace_char, permissions, custom_rules=()):
+        self.temp_suffixes = tuple(temp_extensions)
+        self.bad_chars = re.compile("|".join(re.escape(c) for c in bad_chars)) if bad_chars else None
+        # single characters go through str.translate, longer sequences (if any) through re.sub
+        self.table = str.maketrans({c: replace_char for c in bad_chars if len(c) == 1})
+        longer = [c for c in bad_chars if len(c) > 1]
+        self.longer = re.compile("|".join(re.escape(c) for c in longer)) if longer else None
+        self.replace_char = replace_char
+        self.permissions = permissions
+        now = time.time_ns()
+        self.custom = tuple(Rule(spec, now) for spec in custom_rules)
+
+    def is_temp(self, path):
+        return path.endswith(self.temp_suffixes)
+
+    def has_bad_chars(self, name):
+        return self.bad_chars is not None and self.bad_chars.search(name) is not None
+
+    def sanitize(self, name):
+        if self.longer is not None:
+            name = self.longer.sub(self.replace_char, name)
+        return name.translate(self.table)
+
+    def is_nonstandard_permissions(self, mode):
+        return stat.S_IMODE(mode) != self.permissions
+
+    def custom_match(self, file):
+        # the first matching rule wins, a file gets at most one custom action
+        for rule in self.custom:
+            if rule.matches(file):
+                return rule
+        return None
@@ -0,0 +1,109 @@
+import time
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from modules import FS, execute_action
+
+
+def run_actions(items, touched, resolve, done, jobs=1, window=10000, executor=None):
+    """Run items in order or, with jobs > 1, concurrently where that is safe.
+
+    items may be any iterable, it is read lazily. touched(item) gives the
+    paths an item reads or writes. Items sharing a path depend on each other
+    and run in order (a rename before a move of the same file, a delete
+    before a now redundant move, two moves onto the same destination),
+    everything else may run in parallel. At most window items are held at
+    once.
+    resolve(item) runs on this thread once the item's dependencies are done
+    and returns the action to execute, or None to skip it.
+    done(item, result) runs on this thread after execution.
+    executor (an IOEngine) replaces the pool of jobs threads.
+    Returns (executed, elapsed seconds).
+    The directory descriptors the actions opened are closed before it returns.
+    """
+    try:
+        return _run_actions(items, touched, resolve, done, jobs, window, executor)
+    finally:
+        FS.close()
+
+def _run_actions(items, touched, resolve, done, jobs, window, executor):
+    start = time.perf_counter()
+    executed = 0
+
+    if jobs <= 1 and executor is None:
+        for item in items:
+            action = resolve(item)
+            if action is not None:
+                done(item, execute_action(action))
+                executed += 1
+        return executed, time.perf_counter() - start
+
+    items = iter(items)
+    nodes = {}  # index -> [item, unfinished dependencies, dependents, paths]
+    last = {}  # path -> last unfinished item that touches it
+    ready = deque()
+    in_flight = {}
+    count = 0
+
+    def admit():
+        nonlocal count
+        while len(nodes) < window:
+            item = next(items, None)
+            if item is None:
+                return
+            paths = touched(item)
+            before = {last[p] for p in paths if p in last}
+            for j in before:
+                nodes[j][2].append(count)
+            for p in paths:
+                last[p] = count
+            nodes[count] = [item, len(before), [], paths]
+            if not before:
+                ready.append(count)
+            count += 1
+
+    def finish(i):
+        _, _, dependents, paths = nodes.pop(i)
+        for p in paths:
+            if last.get(p) == i:
+                del last[p]
+        for j in dependents:
+            nodes[j][1] -= 1
+            if not nodes[j][1]:
+                ready.append(j)
+
+    # an IOEngine runs far more calls at once than jobs threads would
+    slots = 2 * (jobs if executor is None else getattr(executor, "capacity", jobs))
+    with (ThreadPoolExecutor(jobs) if executor is None else nullcontext(executor)) as pool:
+        admit()
+        while ready or in_flight:
+            while ready and len(in_flight) < slots:
+                i = ready.popleft()
+                action = resolve(nodes[i][0])
+                if action is None:
+                    finish(i)
+                    continue
+                in_flight[pool.submit(execute_action, action)] = i
+            if in_flight:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    i = in_flight.pop(future)
+                    done(nodes[i][0], future.result())
+                    executed += 1
+                    finish(i)
+            admit()
+    return executed, time.perf_counter() - start
+
+def action_paths(action):
+    paths = {action["path"]}
+    if action.get("new_path"):
+        paths.add(action["new_path"])
+    if action.get("target") and action["action"] != "delete":
+        # a delete only names the kept copy for verify, it does not touch it
+        paths.add(action["target"])
+    paths.update(action.get("links", ()))
+    return paths
+
+def print_throughput(executed, elapsed):
+    rate = executed / elapsed if elapsed > 0 else 0
+    print(f"Executed {executed} actions in {elapsed:.2f}s ({rate:.0f} actions/s)")
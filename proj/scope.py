@@ -0,0 +1,87 @@
+import os
+import re
+import time
+import fnmatch
+
+
+def _compile(patterns):
+    # (name regex, path regex): patterns with a "/" are matched against the whole path
+    by_path = [p for p in patterns if os.sep in p or "/" in p]
+    by_name = [p for p in patterns if p not in by_path]
+    return tuple(
+        re.compile("|".join(fnmatch.translate(p) for p in group)) if group else None
+        for group in (by_name, by_path)
+    )
+
+def _matches(compiled, name, path):
+    by_name, by_path = compiled
+    return (by_name is not None and by_name.match(name) is not None) or \
+        (by_path is not None and by_path.match(path) is not None)
+
+
+class ScanScope:
+    """Which part of SCAN_DIRS a scan looks at, applied by list_directory while walking.
+
+    Exclude globs apply to files and directories, an excluded directory is
+    neither descended into nor stat'ed. Include globs, when given, limit the
+    files and not the directories walked. max_depth 0 keeps a scan to the
+    files directly in a scan root. Names and depth are checked before the
+    stat; size and age limits use the stat list_directory takes anyway, and
+    one_filesystem costs one stat per subdirectory.
+    """
+
+    def __init__(self, include=(), exclude=(), max_depth=None, min_size=0, max_size=None,
+                 older_than_days=None, newer_than_days=None, one_filesystem=False):
+        self.include = _compile(include) if include else None
+        self.exclude = _compile(exclude) if exclude else None
+        self.max_depth = max_depth
+        self.min_size = min_size or 0
+        self.max_size = max_size
+        day_ns = 24 * 3600 * 10**9
+        now = time.time_ns()
+        self.mtime_before = now - older_than_days * day_ns if older_than_days is not None else None
+        self.mtime_after = now - newer_than_days * day_ns if newer_than_days is not None else None
+        self.one_filesystem = one_filesystem
+        self.filters_names = bool(include or exclude)
+        self.filters_stat = bool(self.min_size) or max_size is not None \
+            or older_than_days is not None or newer_than_days is not None
+        # listings kept in a ScanSnapshot are only valid under the same scope;
+        # size and age limits depend on each file's current stat (and the clock),
+        # a file left out last time could be in now, so those listings are never reused (None)
+        self.key = None if self.filters_stat else repr(
+            (sorted(include), sorted(exclude), max_depth, one_filesystem)
+        )
+        self.root_devs = {}
+
+    def wants_dir(self, name, path, depth):
+        # depth of the directory itself, the scan root is 0
+        if self.max_depth is not None and depth > self.max_depth:
+            return False
+        # a directory also matches as path + "/", so "*/cache/*" excludes cache itself
+        # rather than listing it and filtering everything inside
+        return self.exclude is None or not (
+            _matches(self.exclude, name, path) or _matches(self.exclude, name, path + os.sep)
+        )
+
+    def wants_name(self, name, path):
+        if self.exclude is not None and _matches(self.exclude, name, path):
+            return False
+        return self.include is None or _matches(self.include, name, path)
+
+    def wants_stat(self, st):
+        if st.st_size < self.min_size:
+            return False
+        if self.max_size is not None and st.st_size > self.max_size:
+            return False
+        if self.mtime_before is not None and st.st_mtime_ns >= self.mtime_before:
+            return False
+        if self.mtime_after is not None and st.st_mtime_ns <= self.mtime_after:
+            return False
+        return True
+
+    def same_device(self, root, st):
+        # root is the scan root, a subdirectory on another device is a mount point
+        dev = self.root_devs.get(root)
+        if dev is None:
+            dev = self.root_devs[root] = os.stat(root).st_dev
+        return st.st_dev == dev
@@ -0,0 +1,91 @@
+import re
+import hashlib
+from array import array
+from collections import defaultdict
+
+WORDS = re.compile(rb"\w+")
+EMPTY_BIN = 0xFFFFFFFF
+
+
+def _shingle_hash(shingle):
+    return int.from_bytes(hashlib.blake2b(shingle, digest_size=8).digest(), "little")
+
+def minhash_signature(path, size, words, max_bytes):
+    """MinHash of the file's word shingles, None when it cannot be read.
+
+    One hash per shingle (one permutation hashing): the low bits pick one of
+    size bins, the high 32 bits compete for the minimum of that bin. Empty
+    bins borrow from the next filled one so short files still compare.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read(max_bytes)
+    except OSError:
+        return None
+    tokens = WORDS.findall(data.lower())
+    shingles = {b" ".join(tokens[i:i + words]) for i in range(max(len(tokens) - words + 1, 1))}
+
+    signature = array("I", [EMPTY_BIN]) * size
+    for shingle in shingles:
+        h = _shingle_hash(shingle)
+        b = h % size
+        value = h >> 32
+        if value < signature[b]:
+            signature[b] = value
+    filled = [i for i in range(size) if signature[i] != EMPTY_BIN]
+    if len(filled) < size:
+        for i in range(size):
+            if signature[i] == EMPTY_BIN:
+                # circular densification, the offset keeps borrowed bins apart
+                j = next((j for j in filled if j > i), filled[0])
+                signature[i] = (signature[j] + (j - i) % size) & 0x7FFFFFFF
+    return signature
+
+def similarity(a, b):
+    # estimated Jaccard similarity of the two shingle sets
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+def similar_clusters(signatures, bands, threshold, max_bucket):
+    """Group signatures whose estimated similarity reaches threshold.
+
+    Candidate pairs come from LSH: the signature is cut into bands and only
+    signatures equal on a whole band are compared. Bands are bucketed one at
+    a time, and buckets larger than max_bucket (boilerplate shared by many
+    files) are skipped. Returns (clusters as lists of indices, skipped buckets).
+    """
+    rows = len(signatures[0]) // bands if signatures else 0
+    parent = list(range(len(signatures)))
+    skipped = 0
+    raw = [signature.tobytes() for signature in signatures]
+    width = rows * signatures[0].itemsize if signatures else 0
+    for band in range(bands):
+        buckets = defaultdict(list)
+        start, end = band * width, (band + 1) * width
+        for i, data in enumerate(raw):
+            buckets[data[start:end]].append(i)
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+            if len(members) > max_bucket:
+                skipped += 1
+                continue
+            for n, i in enumerate(members):
+                for j in members[:n]:
+                    a, b = _find(parent, j), _find(parent, i)
+                    if a == b:
+                        break
+                    if similarity(signatures[j], signatures[i]) >= threshold:
+                        parent[b] = a
+                        break
+
+    clusters = defaultdict(list)
+    for i in range(len(signatures)):
+        clusters[_find(parent, i)].append(i)
+    return [c for c in clusters.values() if len(c) > 1], skipped
@@ -0,0 +1,93 @@
+import os
+import pickle
+import threading
+from modules import FileRecord
+
+# bumped whenever FileRecord or the pickled layout changes, older snapshots are ignored
+SNAPSHOT_FORMAT = 3
+
+
+class ScanSnapshot:
+    """Directory mtimes and file records from the previous scan.
+
+    A directory whose mtime_ns did not change is not listed again; its
+    subdirectories and file names are taken from the snapshot. Each file is
+    still stat'ed (relative to the open directory), since editing or
+    chmod-ing a file in place leaves the directory mtime alone, and a record
+    whose size, mtime, mode or inode changed is replaced. Subdirectories are
+    still visited, since a change deep in the tree does not touch the mtime
+    of its parents. Listings are reused only under the same scan
+    scope (key, see ScanScope.key); a key of None never reuses them.
+    """
+
+    def __init__(self, path, list_directory, key=""):
+        self.path = path
+        self.list_func = list_directory
+        self.key = key
+        self.old = {}
+        self.new = {}
+        self.listed = 0
+        self.reused = 0
+        self.lock = threading.Lock()
+        try:
+            with open(path, "rb") as f:
+                data = pickle.load(f)
+            if isinstance(data, tuple) and data[0] == SNAPSHOT_FORMAT and key is not None and data[1] == key:
+                self.old = data[2]
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Ignoring unreadable snapshot {path}: {e}")
+
+    def list_directory(self, root, dir):
+        try:
+            mtime_ns = os.stat(root).st_mtime_ns
+        except OSError:
+            return [], []
+        cached = self.old.get((dir, root))
+        files = None
+        if cached is not None and cached[0] == mtime_ns:
+            files = self._restat(root, cached[1])
+        if files is not None:
+            subdirs = cached[2]
+            reused = True
+        else:
+            files, subdirs = self.list_func(root, dir)
+            reused = False
+        with self.lock:
+            self.new[dir, root] = (mtime_ns, files, subdirs)
+            if reused:
+                self.reused += 1
+            else:
+                self.listed += 1
+        return files, subdirs
+
+    def _restat(self, root, records):
+        # fresh records for the cached names, None when one is gone (then the directory is listed again)
+        try:
+            fd = os.open(root, os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC)
+        except OSError:
+            return None
+        try:
+            files = []
+            for file in records:
+                st = os.stat(file.name, dir_fd=fd)
+                if (st.st_size, st.st_mtime_ns, st.st_mode, st.st_ino, st.st_nlink) != \
+                        (file.size, file.mtime_ns, file.mode, file.ino, file.nlink):
+                    file = FileRecord(file.path, file.name, file.dir, st)
+                files.append(file)
+            return files
+        except OSError:
+            return None
+        finally:
+            os.close(fd)
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump((SNAPSHOT_FORMAT, self.key, self.new), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+            return f"Saved scan snapshot to {self.path}"
+        except Exception as e:
+            return f"Error saving scan snapshot to {self.path}: {e}"
@@ -1,35 +1,140 @@
 import os
 import sys
+import time
 import stat
 import argparse
+import cProfile
+import pstats
+from functools import partial
+from collections import Counter
 from modules import scan_directories, analyze_files, execute_action, save_actions_to_json, load_actions_from_json
+from modules import REVIEW_GROUPS, scan_actions, group_actions, list_directory, prepare_replay_actions
+from modules import FS, MovePlanner, main_folder_shard, save_actions_to_jsonl, load_actions_from_jsonl, scan_counters, scan_errors, HASH_NAME
+from snapshot import ScanSnapshot
+from watch import watch_directories
+from scheduler import run_actions, print_throughput, action_paths
+from cache import open_hash_cache
+from parallel import make_executor
+from aio import IOEngine
+from journal import ReplayJournal
+from plan import ActionPlan
+from scope import ScanScope
+from verify import verify_plan, print_verify_report
+from profiling import RunStats, errno_name
 from config import DEFAULT_PERMISSIONS,MAIN_FOLDER
+from config import ACTIONS_FILE, HASH_CACHE_FILE, HASH_CACHE_MAX_AGE, SCAN_JOBS, HASH_POOL
+from config import SNAPSHOT_FILE, ACTIONS_JSONL_FILE, ACTIONS_FORMAT
+from config import REPLAY_JOURNAL_FILE, JOURNAL_SYNC_EVERY, VERIFY_PLAN
+from config import IO_ENGINE, IO_MOUNT_CONCURRENCY, IO_THREADS
+from config import SCAN_INCLUDE, SCAN_EXCLUDE, SCAN_MAX_DEPTH, SCAN_MIN_SIZE, SCAN_MAX_SIZE
+from config import SCAN_OLDER_THAN_DAYS, SCAN_NEWER_THAN_DAYS, SCAN_ONE_FILESYSTEM
 
 
-def print_group_actions(group_name, actions, renamed_paths=None):
-    renamed_paths = renamed_paths or {}
+def print_scan_report(stats):
+    if not stats:
+        return
+    print(f"Scanned {stats['scanned']} files")
+    print(f"  unique size:         {stats['removed_by_size']} removed")
+    print(f"  unique partial hash: {stats['removed_by_partial_hash']} removed")
+    print(f"  unique full hash:    {stats['removed_by_full_hash']} removed")
+    print(f"  duplicate candidates: {stats['duplicates']}")
+    if stats.get("linked_names"):
+        print(f"  hard links:          {stats['linked_names']} names of already seen files, not hashed")
+    print(f"  reclaimable:         {stats['reclaimable_bytes']} bytes")
+    if "near_duplicate_candidates" in stats:
+        print(f"  near duplicate check: {stats['near_duplicate_candidates']} text files")
+    if "cache_hits" in stats:
+        print(f"  hash cache: {stats['cache_hits']} hits, {stats['cache_misses']} misses")
+    if "dirs_reused" in stats:
+        print(f"  directories: {stats['dirs_listed']} listed, {stats['dirs_reused']} unchanged")
+
+def open_cache(args):
+    if args.no_cache:
+        return None
+    cache_path = os.path.join(os.path.dirname(ACTIONS_FILE), HASH_CACHE_FILE)
+    return open_hash_cache(cache_path, HASH_CACHE_MAX_AGE, HASH_NAME)
+
+def scan_scope(args):
+    # config values, with globs from the command line added and limits overridden
+    return ScanScope(
+        SCAN_INCLUDE + (args.include or []), SCAN_EXCLUDE + (args.exclude or []),
+        args.max_depth, args.min_size, args.max_size,
+        args.older_than, args.newer_than, args.one_filesystem
+    )
+
+def action_pairs(args, run_stats):
+    # (group_name, action) pairs from a fresh scan, in group order unless --stream is used
+    cache = open_cache(args)
+    snapshot = None
+    scope = scan_scope(args)
+    list_dir = partial(list_directory, scope=scope)
+    if args.mode == "incremental":
+        snapshot = ScanSnapshot(os.path.join(os.path.dirname(ACTIONS_FILE), SNAPSHOT_FILE), list_dir, scope.key)
+        list_dir = snapshot.list_directory
+    scan_stats = {}
+    try:
+        if args.stream:
+            # walking, hashing and analysis interleave, so they share one timer
+            start = time.perf_counter()
+            for group_name, action in scan_actions(scan_stats, cache, args.jobs, args.hash_pool, list_dir, args.engine):
+                run_stats.counters[f"actions {group_name}"] += 1
+                yield group_name, action
+            run_stats.add_time("stream scan+analyze", time.perf_counter() - start)
+        else:
+            files, duplicates = scan_directories(scan_stats, cache, args.jobs, args.hash_pool, list_dir, args.engine)
+            executor = args.engine or make_executor(args.hash_pool, args.jobs)
+            try:
+                with run_stats.phase("analyze"):
+                    grouped_actions = analyze_files(files, duplicates, scan_stats, executor, cache)
+            finally:
+                if executor is not None and executor is not args.engine:
+                    executor.shutdown()
+            del files, duplicates
+            for group_name, actions in grouped_actions.items():
+                run_stats.counters[f"actions {group_name}"] += len(actions)
+                for action in actions:
+                    yield group_name, action
+    finally:
+        if cache is not None:
+            cache.close()
+    if snapshot is not None:
+        scan_stats["dirs_listed"] = snapshot.listed
+        scan_stats["dirs_reused"] = snapshot.reused
+        print(snapshot.save())
+    print_scan_report(scan_stats)
+    if args.stream:
+        scan_stats.pop("walk_seconds", None)
+        scan_stats.pop("hash_seconds", None)
+    run_stats.add_scan(scan_stats)
+
+def build_actions(args, run_stats):
+    return group_actions(action_pairs(args, run_stats))
+
+LINK_ACTIONS = {"hardlink", "reflink"}
+
+def print_group_actions(group_name, actions, plan=None):
+    current = plan.current if plan is not None else (lambda path: path)
     print(f"\n=== {group_name.replace('_', ' ').title()} ({len(actions)} files) ===")
     for action in actions:
-        current_path = renamed_paths.get(action['path'], action['path'])
+        current_path = current(action['path'])
         print(f"File: {current_path}")
         print(f"Suggested action: {action['action']}")
         if action.get("new_path"):
-            new_path = renamed_paths.get(action['new_path'], action['new_path'])
+            new_path = current(action['new_path'])
             print(f"New path: {new_path}")
         if action.get("new_mode"):
             print(f"New mode: {DEFAULT_PERMISSIONS}")
         print(f"Reason: {action['reason']}")
         print("-" * 50)
 
-def get_file_choice(action, deleted_paths=None, renamed_paths=None):
-    deleted_paths = deleted_paths or set()
-    renamed_paths = renamed_paths or {}
-    
-    current_path = renamed_paths.get(action['path'], action['path'])
+def get_file_choice(action, plan=None):
+    current = plan.current if plan is not None else (lambda path: path)
+
+    current_path = current(action['path'])
     print(f"\nFile: {current_path}")
     print(f"Suggested action: {action['action']}")
     if action.get("new_path"):
-        new_path = renamed_paths.get(action['new_path'], action['new_path'])
+        new_path = current(action['new_path'])
         print(f"New path: {new_path}")
     if action.get("new_mode"):
         print(f"New mode: {DEFAULT_PERMISSIONS}")
@@ -46,11 +151,13 @@ def get_file_choice(action, deleted_paths=None, renamed_paths=None):
         action_prompt += "r: rename, "
     if "chmod" in valid_actions:
         action_prompt += "c: chmod, "
+    if valid_actions & LINK_ACTIONS:
+        action_prompt += "l: link, "
     action_prompt += "k: keep, s: skip): "
 
     while True:
         choice = input(action_prompt).lower()
-        if choice in ['d', 'm', 'r', 'c', 'k', 's']:
+        if choice in ['d', 'm', 'r', 'c', 'l', 'k', 's']:
             if choice == 'd' and "delete" in valid_actions:
                 return "delete", current_path
             elif choice == 'm' and "move" in valid_actions:
@@ -59,35 +166,33 @@ def get_file_choice(action, deleted_paths=None, renamed_paths=None):
                 return "rename", current_path
             elif choice == 'c' and "chmod" in valid_actions:
                 return "chmod", current_path
+            elif choice == 'l' and valid_actions & LINK_ACTIONS:
+                return action["action"], current_path
             elif choice == 'k':
                 return "keep", current_path
             elif choice == 's':
                 return None, current_path
         print("Invalid choice. Please try again.")
 
-def get_group_choice(group_name, actions, mode, deleted_paths=None, renamed_paths=None):
-    deleted_paths = deleted_paths or set()
-    renamed_paths = renamed_paths or {}
-    
+def get_group_choice(group_name, actions, mode, plan=None):
+    current = plan.current if plan is not None else (lambda path: path)
+
     if not actions:
         return []
 
     if mode == "analyze":
         chosen_actions = []
-        print_group_actions(group_name, actions, renamed_paths)
+        print_group_actions(group_name, actions, plan)
         for action in actions:
-            if action['path'] in deleted_paths:
+            if plan is not None and plan.is_deleted(action['path']):
                 print(f"Skipped {action['path']}: already deleted")
                 continue
-            chosen_action, current_path = get_file_choice(action, deleted_paths, renamed_paths)
+            chosen_action, current_path = get_file_choice(action, plan)
             if chosen_action:
-                updated_action = {**action, "action": chosen_action, "path": current_path}
-                if updated_action.get("new_path") and current_path in renamed_paths:
-                    updated_action["new_path"] = renamed_paths[current_path]
-                chosen_actions.append(updated_action)
+                chosen_actions.append({**action, "action": chosen_action, "path": current_path})
         return chosen_actions
     else:  # select mode
-        print_group_actions(group_name, actions, renamed_paths)
+        print_group_actions(group_name, actions, plan)
         valid_actions = set(action["action"] for action in actions)
         action_prompt = "Choose action for all files in this group ("
         if "delete" in valid_actions:
@@ -98,26 +203,30 @@ def get_group_choice(group_name, actions, mode, deleted_paths=None, renamed_path
             action_prompt += "r: rename, "
         if "chmod" in valid_actions:
             action_prompt += "c: chmod, "
+        if valid_actions & LINK_ACTIONS:
+            action_prompt += "l: link, "
         action_prompt += "k: keep, s: skip): "
 
         while True:
             choice = input(action_prompt).lower()
-            if choice in ['d', 'm', 'r', 'c', 'k', 's']:
+            if choice in ['d', 'm', 'r', 'c', 'l', 'k', 's']:
                 if choice == 'd' and "delete" in valid_actions:
-                    return [{"path": renamed_paths.get(a["path"], a["path"]), **a, "action": "delete"} for a in actions]
+                    return [{**a, "path": current(a["path"]), "action": "delete"} for a in actions]
                 elif choice == 'm' and "move" in valid_actions:
-                    return [{"path": renamed_paths.get(a["path"], a["path"]), **a, "action": "move"} for a in actions]
+                    return [{**a, "path": current(a["path"]), "action": "move"} for a in actions]
                 elif choice == 'r' and "rename" in valid_actions:
-                    return [{"path": renamed_paths.get(a["path"], a["path"]), **a, "action": "rename"} for a in actions]
+                    return [{**a, "path": current(a["path"]), "action": "rename"} for a in actions]
                 elif choice == 'c' and "chmod" in valid_actions:
-                    return [{"path": renamed_paths.get(a["path"], a["path"]), **a, "action": "chmod"} for a in actions]
+                    return [{**a, "path": current(a["path"]), "action": "chmod"} for a in actions]
+                elif choice == 'l' and valid_actions & LINK_ACTIONS:
+                    return [{**a, "path": current(a["path"])} for a in actions]
                 elif choice == 'k':
-                    return [{"path": renamed_paths.get(a["path"], a["path"]), **a, "action": "keep"} for a in actions]
+                    return [{**a, "path": current(a["path"]), "action": "keep"} for a in actions]
                 elif choice == 's':
                     return []
             print("Invalid choice. Please try again.")
 
-def select_groups_and_actions(grouped_actions):
+def select_groups_and_actions(grouped_actions, plan=None):
     group_names = [name for name, actions in grouped_actions.items() if actions]
     if not group_names:
         return {}
@@ -127,9 +236,7 @@ def select_groups_and_actions(grouped_actions):
         print(f"{i}. {name.replace('_', ' ').title()} ({len(grouped_actions[name])} files)")
 
     selected_groups = {}
-    deleted_paths = set()
-    renamed_paths = {}
-    
+
     while True:
         choice = input("\nEnter group numbers to process (e.g., '1 2 3', or 'all' for all, or 'done' to finish): ").lower()
         if choice == 'done':
@@ -138,7 +245,7 @@ def select_groups_and_actions(grouped_actions):
             for name in group_names:
                 if name not in selected_groups:
                     selected_groups[name] = get_group_choice(
-                        name, grouped_actions[name], mode="select", deleted_paths=deleted_paths, renamed_paths=renamed_paths
+                        name, grouped_actions[name], mode="select", plan=plan
                     )
             break
 
@@ -149,7 +256,7 @@ def select_groups_and_actions(grouped_actions):
                     name = group_names[idx]
                     if name not in selected_groups:
                         selected_groups[name] = get_group_choice(
-                            name, grouped_actions[name], mode="select", deleted_paths=deleted_paths, renamed_paths=renamed_paths
+                            name, grouped_actions[name], mode="select", plan=plan
                         )
                 else:
                     print(f"Invalid group number: {idx + 1}")
@@ -167,84 +274,291 @@ def parse_arguments():
     )
     parser.add_argument(
         "mode",
-        choices=["analyze", "auto", "replay", "select", "json"],
+        choices=["analyze", "auto", "replay", "select", "json", "incremental", "watch"],
         nargs='?',
         default="analyze",
-        help="Tryb działania: analyze (interaktywny,kazdy plik podtwierdzamy), auto (automatyczny), replay ( wykonaj akcje z JSON-a), select ( grupy plików), json (generuj  JSON)"
+        help="Tryb działania: analyze (interaktywny,kazdy plik podtwierdzamy), auto (automatyczny), replay ( wykonaj akcje z JSON-a), select ( grupy plików), json (generuj  JSON), incremental (JSON, skanuje tylko katalogi zmienione od ostatniego skanu), watch (sledzi zmiany przez inotify i na biezaco aktualizuje JSON)"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Nie uzywaj zapisanych hashy plikow (hash_cache.sqlite)"
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=SCAN_JOBS,
+        metavar="N",
+        help="Liczba watkow do skanowania, hashowania i wykonywania akcji (1 = szeregowo)"
+    )
+    parser.add_argument(
+        "--hash-pool",
+        choices=["thread", "process"],
+        default=HASH_POOL,
+        help="Pula do hashowania: watki albo procesy"
+    )
+    parser.add_argument(
+        "--io-engine",
+        choices=["threads", "async"],
+        default=IO_ENGINE,
+        help="Silnik I/O: threads albo async (asyncio, limit operacji na punkt montowania, dla NFS/SMB; liczba watkow z --io-threads)"
+    )
+    parser.add_argument(
+        "--io-threads",
+        type=int,
+        default=IO_THREADS,
+        metavar="N",
+        help="Silnik async: liczba watkow wykonujacych operacje na plikach (wszystkie punkty montowania razem)"
+    )
+    parser.add_argument(
+        "--include",
+        action="append",
+        metavar="GLOB",
+        help="Skanuj tylko pliki pasujace do wzorca (mozna podac kilka razy, dochodza do SCAN_INCLUDE)"
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        metavar="GLOB",
+        help="Pomin pliki i katalogi pasujace do wzorca, np. .git lub node_modules; do pominietych katalogow skan nie wchodzi"
+    )
+    parser.add_argument(
+        "--max-depth",
+        type=int,
+        default=SCAN_MAX_DEPTH,
+        metavar="N",
+        help="Maksymalna glebokosc katalogow pod SCAN_DIRS (0 = tylko pliki bezposrednio w nich)"
+    )
+    parser.add_argument(
+        "--min-size",
+        type=int,
+        default=SCAN_MIN_SIZE,
+        metavar="BAJTY",
+        help="Pomin pliki mniejsze niz podany rozmiar"
+    )
+    parser.add_argument(
+        "--max-size",
+        type=int,
+        default=SCAN_MAX_SIZE,
+        metavar="BAJTY",
+        help="Pomin pliki wieksze niz podany rozmiar"
+    )
+    parser.add_argument(
+        "--older-than",
+        type=float,
+        default=SCAN_OLDER_THAN_DAYS,
+        metavar="DNI",
+        help="Skanuj tylko pliki zmienione wiecej niz podana liczbe dni temu"
+    )
+    parser.add_argument(
+        "--newer-than",
+        type=float,
+        default=SCAN_NEWER_THAN_DAYS,
+        metavar="DNI",
+        help="Skanuj tylko pliki zmienione mniej niz podana liczbe dni temu"
+    )
+    parser.add_argument(
+        "--one-filesystem",
+        action=argparse.BooleanOptionalAction,
+        default=SCAN_ONE_FILESYSTEM,
+        help="Nie wchodz do katalogow na innych systemach plikow (punktow montowania)"
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Skanuj strumieniowo, bez trzymania listy wszystkich plikow w pamieci"
+    )
+    parser.add_argument(
+        "--format",
+        choices=["json", "jsonl"],
+        default=ACTIONS_FORMAT,
+        help="Format pliku z akcjami dla trybow json i replay: json (pogrupowany, actions.json) albo jsonl (jedna akcja w linii, actions.jsonl)"
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="replay: zacznij od poczatku, ignorujac dziennik przerwanego odtwarzania"
+    )
+    parser.add_argument(
+        "--no-verify",
+        action="store_true",
+        help="replay: nie sprawdzaj przed wykonaniem, czy pliki zmienily sie od zapisania planu"
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Pokaz czasy faz i liczniki (katalogi, pliki, zhashowane bajty, cache, akcje, bledy)"
+    )
+    parser.add_argument(
+        "--stats-json",
+        metavar="PLIK",
+        help="Zapisz statystyki (jak --stats) do pliku JSON"
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="PLIK",
+        help="Uruchom pod cProfile i zapisz wynik do pliku"
     )
     return parser.parse_args()
 
 
 def main():
     args = parse_arguments()
+    run_stats = RunStats()
+    profiler = cProfile.Profile() if args.profile else None
+    args.engine = IOEngine(args.io_threads, IO_MOUNT_CONCURRENCY) if args.io_engine == "async" else None
+    try:
+        if profiler is not None:
+            profiler.runcall(run, args, run_stats)
+        else:
+            run(args, run_stats)
+    finally:
+        if args.engine is not None:
+            args.engine.shutdown()
+        FS.close()
+        if profiler is not None:
+            profiler.dump_stats(args.profile)
+            print(f"\nSaved cProfile data to {args.profile}, top functions by cumulative time:")
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(15)
+        if args.stats or args.stats_json:
+            run_stats.counters.update(scan_counters)
+            run_stats.errors.update({errno_name(code): n for code, n in scan_errors.items()})
+            run_stats.report()
+            if args.stats_json:
+                print(run_stats.save(args.stats_json))
+
+def replayable(triples, review):
+    # (index, group_name, action) -> (index, action), groups in REVIEW_GROUPS are only counted
+    for index, group_name, action in triples:
+        if group_name in REVIEW_GROUPS:
+            review[group_name] += 1
+            continue
+        yield index, action
+
+def verify_replay(items, args, run_stats):
+    """Check the plan against the disk before replay, returns the indices to skip."""
+    executor = args.engine if args.engine is not None else make_executor("thread", args.jobs)
+    try:
+        with run_stats.phase("verify"):
+            stale, flagged, counts = verify_plan(items, executor)
+    finally:
+        if executor is not None and executor is not args.engine:
+            executor.shutdown()
+    print_verify_report(stale, flagged, counts)
+    run_stats.counters.update({f"verify_{key}": value for key, value in counts.items()})
+    return stale
+
+def run(args, run_stats):
     mode = args.mode
 
-    if mode == "json":
-        files, duplicates = scan_directories()
-        grouped_actions = analyze_files(files, duplicates)
+    if mode == "watch":
+        cache = open_cache(args)
+        try:
+            watch_directories(cache, scope=scan_scope(args))
+        except KeyboardInterrupt:
+            print("\nStopped watching.")
+        except OSError as e:
+            print(f"Cannot watch directories: {e}")
+        finally:
+            if cache is not None:
+                cache.close()
+        return
+
+    if mode in ("json", "incremental") and args.format == "jsonl":
+        print(save_actions_to_jsonl(action_pairs(args, run_stats)))
+        print("JSONL generation complete. Use 'replay --format jsonl' mode to execute actions.")
+        return
+
+    if mode in ("json", "incremental"):
+        grouped_actions = build_actions(args, run_stats)
         if not any(grouped_actions.values()):
             print("No actions suggested.")
             return
 
-        # Tworzenie mapowania nowych nazw dla grupy bad_chars
-        renamed_paths = {}
-        if "bad_chars" in grouped_actions:
-            for action in grouped_actions["bad_chars"]:
-                if action["action"] == "rename" and action.get("new_path"):
-                    renamed_paths[action["path"]] = action["new_path"]
-
-        # Zbieranie ścieżek plików do usunięcia z grup temporary, duplicates itp.
-        paths_to_delete = set()
-        for group_name in ["temporary", "duplicates", "empty"]:  # Dodaj inne grupy, jeśli potrzebne
-            if group_name in grouped_actions:
-                for action in grouped_actions[group_name]:
-                    if action["action"] == "delete":
-                        paths_to_delete.add(action["path"])
-
-        # Aktualizacja grupy move_to_x
-        if "move_to_x" in grouped_actions:
-            updated_actions = []
-            for action in grouped_actions["move_to_x"]:
-                current_path = renamed_paths.get(action["path"], action["path"])
-                # Pomijamy pliki, które są sugerowane do usunięcia
-                if current_path in paths_to_delete:
-                    continue
-                updated_action = {**action, "path": current_path}
-                if action.get("new_path"):
-                    updated_action["new_path"] = os.path.join(
-                        MAIN_FOLDER, os.path.basename(current_path)
-                    )
-                updated_actions.append(updated_action)
-            grouped_actions["move_to_x"] = updated_actions
-
-        save_result = save_actions_to_json(grouped_actions)
+        grouped_actions = prepare_replay_actions(grouped_actions)
+        with run_stats.phase("save json"):
+            save_result = save_actions_to_json(grouped_actions)
         print(save_result)
         print("JSON generation complete. Use 'replay' mode to execute actions.")
         return
 
     # Reszta kodu (tryby replay, select, auto, analyze) pozostaje bez zmian
     if mode == "replay":
-        grouped_actions = load_actions_from_json()
-        if not grouped_actions:
+        plan_path = ACTIONS_JSONL_FILE if args.format == "jsonl" else ACTIONS_FILE
+        if not os.path.exists(plan_path):
             print("No actions loaded. Run in analyze, auto, select, or json mode first.")
             return
-        print("Replaying actions from actions.json...")
-        deleted_paths = set()
-        for group_name, actions in grouped_actions.items():
-            if not actions:
-                continue
-            for action in actions:
+        journal = ReplayJournal(
+            os.path.join(os.path.dirname(ACTIONS_FILE), REPLAY_JOURNAL_FILE),
+            plan_path, JOURNAL_SYNC_EVERY, args.restart
+        )
+        finished = False
+        try:
+            stale = {}
+            review = Counter()
+            if args.format == "jsonl":
+                if VERIFY_PLAN and not args.no_verify:
+                    # a first pass over the file, only what verify needs of each action is kept
+                    stale = verify_replay(
+                        replayable(load_actions_from_jsonl(journal.done), Counter()), args, run_stats
+                    )
+                items = replayable(load_actions_from_jsonl(journal.done | stale.keys()), review)
+            else:
+                with run_stats.phase("load json"):
+                    grouped_actions = load_actions_from_json()
+                if not grouped_actions:
+                    print("No actions loaded. Run in analyze, auto, select, or json mode first.")
+                    return
+                items = list(replayable(
+                    (
+                        (index, group_name, action)
+                        for index, (group_name, action) in enumerate(
+                            (group_name, action)
+                            for group_name, actions in grouped_actions.items() for action in actions
+                        )
+                        if index not in journal.done
+                    ),
+                    review
+                ))
+                if VERIFY_PLAN and not args.no_verify:
+                    stale = verify_replay(items, args, run_stats)
+                    items = [item for item in items if item[0] not in stale]
+            print(f"Replaying actions from {plan_path}...")
+            if journal.done:
+                print(f"Resuming: {len(journal.done)} actions already done, see {journal.path}")
+            deleted_paths = set(journal.deleted_paths)
+
+            def resolve(item):
+                index, action = item
                 if action["path"] in deleted_paths:
                     print(f"Skipped {action['path']}: already deleted in this run")
-                    continue
-                result = execute_action(action)
+                    return None
+                return action
+
+            def done(item, result):
+                index, action = item
                 print(result)
+                run_stats.note_result(result)
                 if result.startswith("Deleted:"):
-                    deleted_paths.add(action["path"])
+                    for path in [action["path"], *action.get("links", ())]:
+                        deleted_paths.add(path)
+                        journal.record(index, path)
+                elif not result.startswith("Error"):
+                    # a failed action stays out of the journal, so a resumed replay tries it again
+                    journal.record(index)
+
+            touched = lambda item: action_paths(item[1])
+            executed, elapsed = run_actions(items, touched, resolve, done, args.jobs, executor=args.engine)
+            run_stats.add_time("execute", elapsed)
+            print_throughput(executed, elapsed)
+            for group_name, count in review.items():
+                print(f"Left {count} {group_name} actions for review, run select or analyze mode to act on them")
+            finished = True
+        finally:
+            journal.close(finished)
         return
 
-    files, duplicates = scan_directories()
-    grouped_actions = analyze_files(files, duplicates)
+    grouped_actions = build_actions(args, run_stats)
 
     if not any(grouped_actions.values()):
         print("No actions suggested.")
@@ -254,70 +568,86 @@ def main():
     print(save_result)
 
     print("Processing files...")
-    deleted_paths = set()
-    renamed_paths = {}
+    plan = ActionPlan(grouped_actions)
+    moves = MovePlanner()
 
     if mode == "select":
-        selected_groups = select_groups_and_actions(grouped_actions)
+        selected_groups = select_groups_and_actions(grouped_actions, plan)
         for group_name, actions in selected_groups.items():
             if not actions:
                 continue
-            updated_actions = []
             for action in actions:
-                original_path = action["path"]
-                current_path = renamed_paths.get(original_path, original_path)
-                if current_path in deleted_paths:
+                current_path = plan.current(action["path"])
+                if plan.is_deleted(current_path):
                     print(f"Skipped {current_path}: already deleted")
                     continue
                 action["path"] = current_path
                 if action["action"] == "move":
-                    action["new_path"] = os.path.join(
-                        MAIN_FOLDER, os.path.basename(current_path)
-                    )
+                    action = moves.plan(action, current_path)
                 result = execute_action(action)
                 print(result)
-                if result.startswith("Deleted:"):
-                    deleted_paths.add(current_path)
-                if result.startswith("Renamed:"):
-                    renamed_paths[original_path] = action["new_path"]
-                updated_actions.append(action)
-            grouped_actions[group_name] = [
-                a for a in grouped_actions[group_name] if a["path"] not in deleted_paths
-            ]
-        save_actions_to_json(grouped_actions)
+                plan.note_result(group_name, action, result)
+        save_actions_to_json(plan.remaining())
 
     elif mode == "auto":
-        for group_name, actions in grouped_actions.items():
-            if not actions:
-                continue
-            updated_actions = []
-            for action in actions:
-                current_path = renamed_paths.get(action["path"], action["path"])
-                if current_path in deleted_paths:
-                    print(f"Skipped {current_path}: already deleted")
-                    continue
-                action["path"] = current_path
-                if group_name in ["temporary", "duplicates"]:
-                    result = execute_action({**action, "action": "delete"})
-                    print(result)
-                    if result.startswith("Deleted:"):
-                        deleted_paths.add(current_path)
-                elif group_name == "bad_chars":
-                    result = execute_action({**action, "action": "rename"})
-                    print(result)
-                    if result.startswith("Renamed:"):
-                        renamed_paths[current_path] = action["new_path"]
-                elif group_name == "move_to_x" and current_path not in deleted_paths:
-                    action["new_path"] = os.path.join(
-                        MAIN_FOLDER, os.path.basename(current_path)
-                    )
-                    result = execute_action({**action, "action": "move"})
-                    print(result)
-                updated_actions.append(action)
-            grouped_actions[group_name] = [
-                a for a in grouped_actions[group_name] if a["path"] not in deleted_paths
-            ]
-        save_actions_to_json(grouped_actions)
+        # plan every group up front, renames assumed to succeed, only to know which paths collide
+        planned_renames = {
+            a["path"]: a["new_path"] for a in grouped_actions.get("bad_chars", [])
+        }
+        items = [
+            (group_name, action)
+            for group_name, actions in grouped_actions.items() for action in actions
+        ]
+
+        def touched(item):
+            group_name, action = item
+            current_path = planned_renames.get(action["path"], action["path"])
+            paths = {action["path"], current_path}
+            target = action.get("target") if action["action"] != "delete" else None
+            for path in [target, *action.get("links", ())]:
+                if path:
+                    paths.update((path, planned_renames.get(path, path)))
+            if group_name == "bad_chars":
+                paths.add(action["new_path"])
+            elif group_name == "move_to_x":
+                # the sharded destination MovePlanner starts from, under the name after renames
+                name = os.path.basename(current_path)
+                paths.add(os.path.join(MAIN_FOLDER, main_folder_shard(name, action["expect"]["mtime_ns"]), name))
+            return paths
+
+        def resolve(item):
+            group_name, action = item
+            current_path = plan.current(action["path"])
+            if plan.is_deleted(current_path):
+                print(f"Skipped {current_path}: already deleted")
+                return None
+            action["path"] = current_path
+            if group_name == "temporary":
+                return {**action, "action": "delete"}
+            elif group_name == "duplicates":
+                # delete, or hardlink/reflink to the kept copy (DUPLICATE_ACTION)
+                if action.get("target"):
+                    action["target"] = plan.current(action["target"])
+                if action.get("links"):
+                    action["links"] = [plan.current(p) for p in action["links"]]
+                return {**action}
+            elif group_name == "bad_chars":
+                return {**action, "action": "rename"}
+            elif group_name == "move_to_x":
+                return moves.plan(action, current_path)
+            return None
+
+        def done(item, result):
+            group_name, action = item
+            print(result)
+            run_stats.note_result(result)
+            plan.note_result(group_name, action, result)
+
+        executed, elapsed = run_actions(items, touched, resolve, done, args.jobs, executor=args.engine)
+        run_stats.add_time("execute", elapsed)
+        print_throughput(executed, elapsed)
+        # each group drops files deleted up to and including that group, as the serial loop did
+        save_actions_to_json(plan.remaining())
 
     else:  # analyze mode
         updated_actions = {}
@@ -326,42 +656,27 @@ def main():
                 continue
             updated_actions_list = []
             for action in actions:
-                current_path = renamed_paths.get(action["path"], action["path"])
-                if current_path in deleted_paths:
+                current_path = plan.current(action["path"])
+                if plan.is_deleted(current_path):
                     continue
                 updated_action = {**action, "path": current_path}
                 if action.get("new_path"):
-                    updated_action["new_path"] = renamed_paths.get(
-                        action["new_path"], action["new_path"]
-                    )
+                    updated_action["new_path"] = plan.current(action["new_path"])
                 if group_name == "move_to_x":
-                    updated_action["new_path"] = os.path.join(
-                        MAIN_FOLDER, os.path.basename(current_path)
-                    )
+                    updated_action = moves.plan(updated_action, current_path)
                 updated_actions_list.append(updated_action)
             chosen_actions = get_group_choice(
-                group_name, updated_actions_list, mode="analyze", deleted_paths=deleted_paths, renamed_paths=renamed_paths
+                group_name, updated_actions_list, mode="analyze", plan=plan
             )
             updated_actions[group_name] = []
             for chosen_action in chosen_actions:
-                if chosen_action:
-                    if chosen_action["action"] == "move" and chosen_action["path"] in deleted_paths:
-                        print(f"Skipped moving {chosen_action['path']}: already deleted")
-                        continue
-                    result = execute_action(chosen_action)
-                    print(result)
-                    updated_actions[group_name].append(chosen_action)
-                    if result.startswith("Deleted:"):
-                        deleted_paths.add(chosen_action["path"])
-                    if result.startswith("Renamed:"):
-                        renamed_paths[chosen_action["path"]] = chosen_action["new_path"]
-                else:
-                    updated_actions[group_name].append(
-                        next(a for a in actions if a["path"] == chosen_action["path"])
-                    )
-            grouped_actions[group_name] = [
-                a for a in grouped_actions[group_name] if a["path"] not in deleted_paths
-            ]
+                if chosen_action["action"] == "move" and plan.is_deleted(chosen_action["path"]):
+                    print(f"Skipped moving {chosen_action['path']}: already deleted")
+                    continue
+                result = execute_action(chosen_action)
+                print(result)
+                updated_actions[group_name].append(chosen_action)
+                plan.note_result(group_name, chosen_action, result)
         save_actions_to_json(updated_actions)
 
     print("Processing complete. Actions saved to actions.json.")
@@ -0,0 +1,154 @@
+import os
+from collections import defaultdict, Counter
+
+from config import HASH_BUFFER_SIZE, HASH_MMAP_MIN_SIZE
+from parallel import bounded_map
+from hashing import HASHERS, hash_file
+
+# actions that lose data if they run on a file that changed since the plan was made
+DESTRUCTIVE = ("delete", "hardlink", "reflink")
+
+
+def _stat_directory(directory, names):
+    # one task per directory: open it once and stat every name relative to it
+    try:
+        fd = os.open(directory or ".", os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC)
+    except OSError:
+        return [None] * len(names)
+    stats = []
+    try:
+        for name in names:
+            try:
+                # followed like DirEntry.stat() in list_directory, where the fingerprints come from
+                st = os.stat(name, dir_fd=fd)
+                stats.append((st.st_size, st.st_mtime_ns, st.st_ino))
+            except OSError:
+                stats.append(None)
+    finally:
+        os.close(fd)
+    return stats
+
+def stat_paths(paths, executor=None):
+    """path -> (size, mtime_ns, ino) or None, one stat task per parent directory."""
+    by_dir = defaultdict(list)
+    for path in paths:
+        directory, name = os.path.split(path)
+        by_dir[directory].append(name)
+    result = {}
+    dirs = list(by_dir)
+    for directory, stats in zip(dirs, bounded_map(executor, _stat_directory, dirs, (by_dir[d] for d in dirs))):
+        for name, st in zip(by_dir[directory], stats):
+            result[os.path.join(directory, name)] = st
+    return result
+
+def _rehash(path, algorithm):
+    try:
+        return hash_file(path, algorithm, HASH_BUFFER_SIZE, HASH_MMAP_MIN_SIZE)
+    except (OSError, ValueError):
+        return None
+
+
+class PlanCheck:
+    """What verify_plan needs of one action, the rest of it is not kept."""
+    __slots__ = ("index", "action", "path", "expect", "target", "target_expect", "hash", "algorithm")
+
+    def __init__(self, index, action, original):
+        self.index = index
+        self.action = action["action"]
+        # before the plan's own renames have run the file still has its old name
+        self.path = (original.get(action["path"], action["path"]), action["path"])
+        self.expect = action.get("expect")
+        target = action.get("target")
+        self.target = (original.get(target, target), target) if target else None
+        self.target_expect = action.get("target_expect")
+        self.hash = action.get("hash")
+        self.algorithm = action.get("hash_algorithm")
+
+
+def verify_plan(items, executor=None):
+    """Re-stat the files of (index, action) items against the fingerprints saved in the plan.
+
+    Returns (stale, flagged, counts): stale maps the index of every action
+    that must not run to the reason, flagged does the same for actions that
+    still run but whose file was replaced. A destructive action on a file
+    whose size, mtime or inode changed is dropped, unless it carries a
+    content hash and the file (and its kept copy) still hashes the same;
+    only those files are read again. Any action on a missing file is dropped.
+    Actions without a saved fingerprint (older plans) pass unchecked.
+    """
+    checks = []
+    original = {}
+    for index, action in items:
+        if action["action"] == "rename" and action.get("new_path"):
+            original[action["new_path"]] = original.get(action["path"], action["path"])
+        if action.get("expect") is not None:
+            checks.append(PlanCheck(index, action, original))
+
+    paths = set()
+    for check in checks:
+        paths.update(check.path)
+        if check.target is not None:
+            paths.update(check.target)
+    stats = stat_paths(paths, executor)
+
+    def current(candidates):
+        for path in candidates:
+            if stats.get(path) is not None:
+                return path, stats[path]
+        return candidates[-1], None
+
+    stale = {}
+    flagged = {}
+    counts = Counter()
+    rehash = []  # (check, [paths that must still hash to check.hash])
+    for check in checks:
+        path, st = current(check.path)
+        if st is None:
+            stale[check.index] = f"{path} no longer exists"
+            continue
+        changed = []
+        if st != (check.expect["size"], check.expect["mtime_ns"], check.expect["ino"]):
+            changed.append((path, st, check.expect))
+        if check.target is not None and check.target_expect is not None:
+            target, target_st = current(check.target)
+            if target_st is None:
+                stale[check.index] = f"kept copy {target} no longer exists"
+                continue
+            expected = (check.target_expect["size"], check.target_expect["mtime_ns"], check.target_expect["ino"])
+            if target_st != expected:
+                changed.append((target, target_st, check.target_expect))
+        if not changed:
+            continue
+        counts["changed"] += 1
+        if check.action not in DESTRUCTIVE:
+            if st[2] != check.expect["ino"]:
+                flagged[check.index] = f"{path} was replaced since the plan was made"
+            continue
+        if check.hash is None or check.algorithm not in HASHERS or any(s[0] != e["size"] for _, s, e in changed):
+            stale[check.index] = f"{changed[0][0]} changed since the plan was made"
+            continue
+        rehash.append((check, [p for p, _, _ in changed]))
+
+    # content is read again only where metadata changed and a hash can settle it
+    jobs = [(check, p) for check, changed_paths in rehash for p in changed_paths]
+    digests = bounded_map(executor, _rehash, [p for _, p in jobs], [check.algorithm for check, _ in jobs])
+    for (check, path), digest in zip(jobs, digests):
+        counts["rehashed"] += 1
+        if digest != check.hash and check.index not in stale:
+            stale[check.index] = f"{path} changed since the plan was made (content differs)"
+
+    counts["checked"] = len(checks)
+    counts["stale"] = len(stale)
+    counts["flagged"] = len(flagged)
+    return stale, flagged, counts
+
+def print_verify_report(stale, flagged, counts, limit=20):
+    print(
+        f"Verified {counts['checked']} actions: {counts['changed']} changed since the plan was made, "
+        f"{counts['rehashed']} files rehashed, {counts['stale']} dropped, {counts['flagged']} flagged"
+    )
+    for label, reasons in (("Dropped", stale), ("Flagged", flagged)):
+        for index in sorted(reasons)[:limit]:
+            print(f"{label} action {index}: {reasons[index]}")
+        if len(reasons) > limit:
+            print(f"... and {len(reasons) - limit} more")
@@ -0,0 +1,224 @@
+import os
+import stat
+import struct
+import ctypes
+import ctypes.util
+import selectors
+from collections import defaultdict
+from itertools import chain
+from modules import FileRecord, list_directory, walk_files, iter_files, find_duplicates
+from modules import file_actions, same_name_actions, duplicate_actions, group_actions, is_empty
+from modules import save_actions_to_json, prepare_replay_actions, SCOPE
+from config import SCAN_DIRS, WATCH_DELAY
+
+# from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+              | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """Minimal inotify wrapper on top of libc through ctypes."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available on this system")
+        self.libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.fd, selectors.EVENT_READ)
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def read_events(self, timeout=None):
+        # list of (wd, mask, cookie, name), empty when timeout passes without events
+        if not self.selector.select(timeout):
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            events.append((wd, mask, cookie, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        self.selector.close()
+        os.close(self.fd)
+
+
+class WatchIndex:
+    """Files under SCAN_DIRS and their suggested actions, updated file by file."""
+
+    def __init__(self, cache=None, scope=SCOPE):
+        self.cache = cache
+        self.scope = scope
+        self.files = {}
+        self.per_file = {}
+        self.by_name = defaultdict(dict)
+        self.by_size = defaultdict(dict)
+        self.duplicates = {}
+        self.dirty_sizes = set()
+        self.dirs = {}  # directory -> scan root it belongs to
+
+    def _list(self, root, dir):
+        self.dirs[root] = dir
+        return list_directory(root, dir, self.scope)
+
+    def scan(self, root=None, dir=None):
+        files = iter_files(1, self._list) if root is None else walk_files(root, dir, self._list)
+        for file in files:
+            self.add(file)
+
+    def add(self, file):
+        self.remove(file.path)
+        self.files[file.path] = file
+        self.per_file[file.path] = list(file_actions(file))
+        if not is_empty(file):
+            self.by_name[file.name][file.path] = None
+        self.by_size[file.size][file.path] = None
+        self.dirty_sizes.add(file.size)
+
+    def remove(self, path):
+        file = self.files.pop(path, None)
+        if file is None:
+            return
+        del self.per_file[path]
+        for buckets, key in ((self.by_name, file.name), (self.by_size, file.size)):
+            buckets[key].pop(path, None)
+            if not buckets[key]:
+                del buckets[key]
+        self.dirty_sizes.add(file.size)
+
+    def remove_tree(self, dir):
+        prefix = dir + os.sep
+        for path in [p for p in self.files if p.startswith(prefix)]:
+            self.remove(path)
+        for d in [d for d in self.dirs if d == dir or d.startswith(prefix)]:
+            del self.dirs[d]
+
+    def update(self, path, dir):
+        name = os.path.basename(path)
+        if self.scope.filters_names and not self.scope.wants_name(name, path):
+            return
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.remove(path)
+            return
+        if stat.S_ISDIR(st.st_mode):
+            return
+        if self.scope.filters_stat and not self.scope.wants_stat(st):
+            # grown past a size limit, say
+            self.remove(path)
+            return
+        self.add(FileRecord(path, name, dir, st))
+
+    def grouped_actions(self):
+        # only size buckets touched since the last call are hashed again
+        for size in self.dirty_sizes:
+            bucket = [self.files[p] for p in self.by_size.get(size, ())]
+            if len(bucket) > 1:
+                self.duplicates[size] = find_duplicates(bucket, cache=self.cache)
+            else:
+                self.duplicates.pop(size, None)
+        self.dirty_sizes.clear()
+
+        name_map = {
+            name: [self.files[p] for p in paths]
+            for name, paths in self.by_name.items() if len(paths) > 1
+        }
+        return group_actions(chain(
+            (pair for actions in self.per_file.values() for pair in actions),
+            same_name_actions(name_map),
+            (pair for dups in self.duplicates.values() for pair in duplicate_actions(dups)),
+        ))
+
+
+def _add_watches(inotify, watches, dirs):
+    for dir in dirs:
+        try:
+            watches[inotify.add_watch(dir)] = dir
+        except OSError as e:
+            print(f"Cannot watch {dir}: {e}")
+
+def watch_directories(cache=None, delay=WATCH_DELAY, scope=SCOPE):
+    """Full scan, then keep the index and actions.json up to date from inotify events."""
+    index = WatchIndex(cache, scope)
+    index.scan()
+    print(save_actions_to_json(prepare_replay_actions(index.grouped_actions())))
+
+    inotify = Inotify()
+    watches = {}
+    try:
+        _add_watches(inotify, watches, list(index.dirs))
+        print(f"Watching {len(watches)} directories under {', '.join(SCAN_DIRS)} (Ctrl+C to stop)")
+        changed = False
+        while True:
+            events = inotify.read_events(delay if changed else None)
+            if not events:
+                if changed:
+                    print(save_actions_to_json(prepare_replay_actions(index.grouped_actions())))
+                    if cache is not None:
+                        cache.commit()
+                    changed = False
+                continue
+
+            for wd, mask, cookie, name in events:
+                if mask & IN_Q_OVERFLOW:
+                    # events were lost, start over
+                    index = WatchIndex(cache, scope)
+                    index.scan()
+                    _add_watches(inotify, watches, list(index.dirs))
+                    changed = True
+                    continue
+                if mask & IN_IGNORED:
+                    watches.pop(wd, None)
+                    continue
+                dir = watches.get(wd)
+                if dir is None or not name:
+                    continue
+                path = os.path.join(dir, name)
+                root = index.dirs.get(dir, dir)
+                changed = True
+                if mask & IN_ISDIR:
+                    if mask & (IN_DELETE | IN_MOVED_FROM):
+                        index.remove_tree(path)
+                    elif mask & (IN_CREATE | IN_MOVED_TO) and index.scope.wants_dir(name, path, path[len(root):].count(os.sep)):
+                        known = set(index.dirs)
+                        index.scan(path, root)
+                        _add_watches(inotify, watches, [d for d in index.dirs if d not in known])
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    index.remove(path)
+                else:
+                    index.update(path, root)
+    finally:
+        inotify.close()